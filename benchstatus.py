@@ -0,0 +1,55 @@
+"""
+Utility script that benchmarks bytes transferred and time taken per poll of the
+status page, comparing uncached renders, cached renders and conditional GETs
+
+Runs entirely in-process using Flask's test client so no webserver is required:
+
+python3 benchstatus.py [NUMBER_OF_POLLS]
+"""
+
+import sys
+import time
+from sysadmin import app, STATUSPAGECACHE
+
+# Default number of polls per scenario
+POLLS = 1000
+
+
+def poll(client, polls, headers={}, clearcache=False):
+    """
+    Poll status page repeatedly, returning average bytes and milliseconds per poll
+    """
+
+    totalbytes = 0
+    start = time.perf_counter()
+    for i in range(polls):
+        if clearcache: STATUSPAGECACHE.clear()
+        response = client.get('/', headers=headers)
+        totalbytes += len(response.get_data())
+    elapsed = time.perf_counter() - start
+
+    return response.status_code, totalbytes / polls, 1000 * elapsed / polls
+
+def report(name, results):
+    """
+    Print single line of benchmark results
+    """
+
+    status, bytesperpoll, msperpoll = results
+    print("%-28s %6d %12.0f %12.3f" % (name, status, bytesperpoll, msperpoll))
+
+
+if __name__ == '__main__':
+    polls = int(sys.argv[1]) if len(sys.argv) > 1 else POLLS
+    client = app.test_client()
+
+    # Warm up and retrieve current validators
+    response = client.get('/')
+    etag = response.headers['ETag']
+    lastmodified = response.headers['Last-Modified']
+
+    print("%-28s %6s %12s %12s" % ("Scenario (" + str(polls) + " polls)", "Status", "Bytes/poll", "ms/poll"))
+    report("Uncached render", poll(client, polls, clearcache=True))
+    report("Cached render", poll(client, polls))
+    report("If-None-Match", poll(client, polls, headers={'If-None-Match': etag}))
+    report("If-Modified-Since", poll(client, polls, headers={'If-Modified-Since': lastmodified}))
@@ -0,0 +1,162 @@
+"""
+Utility script that builds fingerprinted, precompressed local copies of the
+Material Kit CSS/JS files used by the sysadmin templates
+
+Each file listed in ASSETS is copied from X-Risk's 'static' folder into ASSETSDIR
+with a content hash in its filename alongside gzip (and brotli, if installed) versions
+A manifest mapping original paths to fingerprinted filenames is used by sysadmin.py
+to serve files with long-lived cache headers
+
+Run during setup and whenever X-Risk's static files change, then reload Apache so
+sysadmin.py loads the new manifest:
+
+python3 buildassets.py
+sudo apachectl graceful
+
+Files from the previous build are kept so pages already rendered by running processes,
+or cached by browsers, still load their assets
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Location of source static files - symlink to X-Risk's 'static' folder created by setup.sh
+STATICDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Location of fingerprinted and precompressed assets
+ASSETSDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+# Location of manifest mapping original paths to fingerprinted filenames
+ASSETSMANIFEST = os.path.join(ASSETSDIR, 'manifest.json')
+
+# Static files used by templates/base.html
+ASSETS = [
+    'favicon.ico',
+    'logo_small_highres.png',
+    'material-kit/css/material-kit.css',
+    'material-kit/bootstrap-select/css/bootstrap-select.css',
+    'css/custom.css',
+    'material-kit/js/core/jquery.min.js',
+    'material-kit/js/core/popper.min.js',
+    'material-kit/js/core/bootstrap-material-design.min.js',
+    'material-kit/js/plugins/moment.min.js',
+    'material-kit/js/plugins/bootstrap-datetimepicker.js',
+    'material-kit/js/plugins/nouislider.min.js',
+    'material-kit/bootstrap-select/js/bootstrap-select.js',
+    'material-kit/js/material-kit.js',
+]
+
+# Only text-based files benefit from compression
+COMPRESSEDEXTENSIONS = ('.css', '.js', '.ico')
+
+# Length of content hash inserted into filenames
+FINGERPRINTLENGTH = 12
+
+
+def loadmanifest():
+    """
+    Load manifest of fingerprinted assets, returning empty manifest if assets not built
+    """
+
+    if os.path.isfile(ASSETSMANIFEST) is False:
+        return {}
+
+    with open(ASSETSMANIFEST) as f:
+        return json.load(f)
+
+def fingerprint(path, content):
+    """
+    Insert content hash into filename, eg. 'css/custom.css' -> 'css/custom.0123456789ab.css'
+    """
+
+    root, ext = os.path.splitext(path)
+    digest = hashlib.sha256(content).hexdigest()[:FINGERPRINTLENGTH]
+    return root + '.' + digest + ext
+
+def buildasset(path):
+    """
+    Write fingerprinted and precompressed copies of single static file
+    Returns fingerprinted filename relative to ASSETSDIR
+    """
+
+    with open(os.path.join(STATICDIR, path), 'rb') as f:
+        content = f.read()
+
+    fingerprinted = fingerprint(path, content)
+    destination = os.path.join(ASSETSDIR, fingerprinted)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    # Filename is derived from content so existing files are left alone rather than
+    # truncated and rewritten while running processes may be serving them
+    if os.path.isfile(destination) is False:
+        with open(destination, 'wb') as f:
+            f.write(content)
+
+    if path.endswith(COMPRESSEDEXTENSIONS):
+        # Fixed mtime so identical content always produces identical .gz file
+        if os.path.isfile(destination + '.gz') is False:
+            with gzip.GzipFile(destination + '.gz', 'wb', compresslevel=9, mtime=0) as f:
+                f.write(content)
+        if (brotli is not None) and (os.path.isfile(destination + '.br') is False):
+            with open(destination + '.br', 'wb') as f:
+                f.write(brotli.compress(content))
+
+    return fingerprinted
+
+def removeoldassets(keep):
+    """
+    Remove fingerprinted files (and compressed versions) not in keep from ASSETSDIR
+    """
+
+    for folder, subfolders, filenames in os.walk(ASSETSDIR):
+        for filename in filenames:
+            filepath = os.path.join(folder, filename)
+            if filepath == ASSETSMANIFEST: continue
+            fingerprinted = os.path.relpath(filepath, ASSETSDIR)
+            for extension in ('.gz', '.br'):
+                if fingerprinted.endswith(extension): fingerprinted = fingerprinted[:-len(extension)]
+            if fingerprinted not in keep:
+                os.remove(filepath)
+
+def build():
+    """
+    Build assets into ASSETSDIR and write manifest
+
+    Files from previous build are kept for processes still using previous manifest,
+    files from older builds are removed
+    """
+
+    previousmanifest = loadmanifest()
+    os.makedirs(ASSETSDIR, exist_ok=True)
+
+    manifest = {}
+    for path in ASSETS:
+        if os.path.isfile(os.path.join(STATICDIR, path)) is False:
+            print("WARNING: Static file not found, will be served from /static: " + path)
+            continue
+        manifest[path] = buildasset(path)
+
+    # Manifest is replaced in one step so processes starting during build never read partial manifest
+    fd, tempfilename = tempfile.mkstemp(dir=ASSETSDIR)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.chmod(tempfilename, 0o644)
+    os.replace(tempfilename, ASSETSMANIFEST)
+
+    removeoldassets(set(manifest.values()) | set(previousmanifest.values()))
+
+    if brotli is None:
+        print("WARNING: 'brotli' library not installed - only gzip versions created")
+    print("Built " + str(len(manifest)) + " assets in " + ASSETSDIR)
+
+
+if __name__ == '__main__':
+    build()
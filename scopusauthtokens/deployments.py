@@ -0,0 +1,121 @@
+"""
+Library to manage registry of X-Risk/TERRA deployments monitored by single sysadmin instance
+
+The default deployment (None) is the sibling '../x-risk' folder using the settings in
+adminconfig.py. Further deployments are registered in adminconfig.DEPLOYMENTS, eg:
+
+DEPLOYMENTS = {
+    'staging': {
+        'XRISKDIR': '/home/projects/x-risk-staging',
+        'ADMINCONTACTEMAIL': 'staging-admin@yourdomain.com',
+    },
+}
+
+Each deployment has its own config.json (authentication tokens and expiry date), admin
+contact and namespaced passcode, tokenchecker and notifications state files which are
+created when first used
+"""
+
+import os
+import re
+import json
+import tempfile
+import pwd
+import grp
+import adminconfig
+
+# Registered deployments in addition to default deployment
+DEPLOYMENTS = getattr(adminconfig, 'DEPLOYMENTS', {})
+
+# Deployment names are used in URLs and state filenames
+DEPLOYMENTNAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+for name in DEPLOYMENTS:
+    if DEPLOYMENTNAME.match(name) is None:
+        raise ValueError("Invalid deployment name in adminconfig.DEPLOYMENTS: '" + name + "' - use letters, numbers, '-' and '_' only")
+    if (isinstance(DEPLOYMENTS[name], dict) is False) or (isinstance(DEPLOYMENTS[name].get('XRISKDIR'), str) is False):
+        raise ValueError("Missing 'XRISKDIR' for deployment in adminconfig.DEPLOYMENTS: '" + name + "'")
+
+# Location of default X-Risk folder which shares parent folder with x-risk-admin
+DEFAULTXRISKDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir, 'x-risk'))
+
+
+def deploymentnames():
+    """
+    Get names of all deployments with default deployment first
+    """
+
+    return [None] + sorted(DEPLOYMENTS)
+
+def isdeployment(deployment):
+    """
+    Checks whether deployment is registered
+    """
+
+    return (deployment is None) or (deployment in DEPLOYMENTS)
+
+def label(deployment):
+    """
+    Human-readable name of deployment
+    """
+
+    if deployment is None: return 'X-Risk/TERRA'
+    return deployment
+
+def xriskdir(deployment=None):
+    """
+    Location of deployment's X-Risk folder
+    """
+
+    if deployment is None: return DEFAULTXRISKDIR
+    return DEPLOYMENTS[deployment]['XRISKDIR']
+
+def admincontactemail(deployment=None):
+    """
+    Admin email address that deployment's notifications and reset links are sent to
+    """
+
+    if deployment is None: return adminconfig.ADMINCONTACTEMAIL
+    return DEPLOYMENTS[deployment].get('ADMINCONTACTEMAIL', adminconfig.ADMINCONTACTEMAIL)
+
+def adminurl(deployment=None):
+    """
+    Base URL of deployment's pages within sysadmin website
+    """
+
+    if deployment is None: return adminconfig.ADMINURL
+    return adminconfig.ADMINURL + '/deployments/' + deployment
+
+def statefile(defaultfile, deployment, initialvalues):
+    """
+    Get location of deployment's state file, creating it if not exists
+
+    File is written to temporary file then linked into place so processes starting at 
+    the same time never read partially-written file or overwrite each other's changes
+
+    State files of registered deployments are namespaced using deployment name,
+    eg. 'passcode/passcode.json' becomes 'passcode/passcode-staging.json'
+    """
+
+    filename = defaultfile
+    if deployment is not None:
+        root, ext = os.path.splitext(defaultfile)
+        filename = root + '-' + deployment + ext
+
+    if os.path.isfile(filename) is False:
+        fd, tempfilename = tempfile.mkstemp(dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(initialvalues, f, indent=4)
+            os.chmod(tempfilename, 0o644)
+            # Change file owner so Apache can modify
+            uid = pwd.getpwnam(adminconfig.WWW_USER).pw_uid
+            gid = grp.getgrnam(adminconfig.WWW_USER).gr_gid
+            os.chown(tempfilename, uid, gid)
+            os.link(tempfilename, filename)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tempfilename)
+
+    return filename
@@ -0,0 +1,168 @@
+"""
+Library for structured logging of events such as check results, passcode events,
+token saves and email sends to a JSON lines file that can be tailed and filtered, eg:
+
+event('tokens.saved', deployment='staging', expirydate='2027-01-01')
+
+writes:
+
+{"time": "2026-10-19T14:40:00.123456", "event": "tokens.saved", "pid": 1234, "deployment": "staging", "expirydate": "2027-01-01"}
+
+The calling thread only places the event on a bounded queue - formatting and writing is
+carried out by a background writer thread so request and cron threads never wait on disk.
+If the queue is full the event is dropped and the number of dropped events is recorded on
+the next event written. The event file is shared by all processes and is rotated once a day
+and whenever it reaches EVENTLOGMAXBYTES
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from datetime import datetime
+from scopusauthtokens.logfiles import rotatingfile
+
+# Location of event log file
+EVENTLOGFILE = 'events.jsonl'
+EVENTLOGFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "events", EVENTLOGFILE)
+
+# Size in bytes at which event log file is rotated and number of rotated files kept
+EVENTLOGMAXBYTES = 10 * 1024 * 1024
+EVENTLOGBACKUPS = 14
+
+# Maximum number of events waiting to be written - further events are dropped
+EVENTQUEUESIZE = 10000
+
+# Name of logger events are sent to
+EVENTLOGGER = 'xriskadmin.events'
+
+
+class droppingqueuehandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops events when queue is full rather than blocking or raising
+    """
+
+    def __init__(self, eventqueue):
+        """
+        Init handler with bounded queue
+        """
+
+        super().__init__(eventqueue)
+        self.dropped = 0
+        self.unreported = 0
+        self.droppedlock = threading.Lock()
+
+    def prepare(self, record):
+        """
+        Pass record to writer thread unformatted so formatting cost isn't paid by calling thread
+        """
+
+        return record
+
+    def enqueue(self, record):
+        """
+        Place record on queue, counting record as dropped if queue is full
+        """
+
+        if self.unreported:
+            with self.droppedlock:
+                record.event['dropped'], self.unreported = self.unreported, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.droppedlock:
+                self.dropped += 1
+                self.unreported += 1 + record.event.pop('dropped', 0)
+
+
+class rotatingeventhandler(logging.Handler):
+    """
+    Handler that appends events to event log file shared by all processes, rotating it
+    daily and when it reaches EVENTLOGMAXBYTES
+    """
+
+    def __init__(self, filename):
+        """
+        Init handler - file isn't opened until first event written
+        """
+
+        super().__init__()
+        self.file = rotatingfile(filename, EVENTLOGMAXBYTES, EVENTLOGBACKUPS, daily=True)
+
+    def emit(self, record):
+        """
+        Write formatted event as single line
+        """
+
+        try:
+            self.file.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        """
+        Close event log file
+        """
+
+        self.file.close()
+        super().close()
+
+
+class jsonformatter(logging.Formatter):
+    """
+    Format event as single JSON line
+    """
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(), 'event': record.msg, 'pid': record.process}
+        entry.update(record.event)
+        return json.dumps(entry, default=str)
+
+
+EVENTQUEUE = queue.Queue(EVENTQUEUESIZE)
+EVENTHANDLER = droppingqueuehandler(EVENTQUEUE)
+
+EVENTWRITER = rotatingeventhandler(EVENTLOGFILE)
+EVENTWRITER.setFormatter(jsonformatter())
+EVENTLISTENER = logging.handlers.QueueListener(EVENTQUEUE, EVENTWRITER)
+
+# Events are kept out of root logger so they aren't mixed into Apache's error log
+logger = logging.getLogger(EVENTLOGGER)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(EVENTHANDLER)
+
+# Writer thread is started when first event is logged
+writerlock = threading.Lock()
+writerstarted = False
+
+
+def startwriter():
+    """
+    Start background writer thread, writing remaining events when process exits
+    """
+
+    global writerstarted
+    with writerlock:
+        if writerstarted: return
+        EVENTLISTENER.start()
+        atexit.register(EVENTLISTENER.stop)
+        writerstarted = True
+
+def event(name, **fields):
+    """
+    Log event with supplied fields
+    """
+
+    if writerstarted is False: startwriter()
+    logger.info(name, extra={'event': fields})
+
+def droppedevents():
+    """
+    Total number of events dropped because queue was full
+    """
+
+    return EVENTHANDLER.dropped
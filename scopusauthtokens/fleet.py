@@ -0,0 +1,36 @@
+"""
+Library to run checks across all registered X-Risk/TERRA deployments concurrently
+
+Checks fan out over a bounded pool of worker threads so, as long as there are no more
+deployments than FLEETWORKERS, a check cycle takes as long as the slowest deployment
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import adminconfig
+from scopusauthtokens.deployments import deploymentnames
+from scopusauthtokens.tracing import wrap
+
+# Maximum number of deployments checked at the same time
+FLEETWORKERS = getattr(adminconfig, 'FLEETWORKERS', 8)
+
+
+def checkall(check):
+    """
+    Run check(deployment) for every deployment concurrently
+
+    Returns list of (deployment, result) in registry order. If check raises an exception
+    for a deployment, the exception is returned as its result so other deployments still complete
+    Spans created by checks are children of current span
+    """
+
+    def safecheck(deployment):
+        try:
+            return check(deployment)
+        except Exception as e:
+            return e
+
+    names = deploymentnames()
+    with ThreadPoolExecutor(max_workers=min(FLEETWORKERS, len(names))) as executor:
+        results = list(executor.map(wrap(safecheck), names))
+
+    return list(zip(names, results))
@@ -0,0 +1,44 @@
+"""
+Library to provide 'Instructions.pdf' attachment included in every notification email
+
+The PDF is read and base64-encoded once per process and reused for every email sent
+"""
+
+import os
+import threading
+from email import encoders
+from email.mime.base import MIMEBase
+
+# Location of instructions PDF file
+INSTRUCTIONS_FILE = "Instructions.pdf"
+INSTRUCTIONS = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir, INSTRUCTIONS_FILE)
+
+# Base64-encoded contents of instructions PDF file
+INSTRUCTIONSCACHE = {}
+instructionslock = threading.Lock()
+
+
+def encodedinstructions():
+    """
+    Get base64-encoded instructions PDF, reading file on first use
+    """
+
+    with instructionslock:
+        if 'PAYLOAD' not in INSTRUCTIONSCACHE:
+            part = MIMEBase("application", "octet-stream")
+            with open(INSTRUCTIONS, "rb") as attachment:
+                part.set_payload(attachment.read())
+            encoders.encode_base64(part)
+            INSTRUCTIONSCACHE['PAYLOAD'] = part.get_payload()
+    return INSTRUCTIONSCACHE['PAYLOAD']
+
+def instructionsattachment():
+    """
+    Create email attachment part containing instructions PDF
+    """
+
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(encodedinstructions())
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", f"attachment; filename= {INSTRUCTIONS_FILE}",)
+    return part
@@ -0,0 +1,304 @@
+"""
+Library to run token updates as background jobs so web requests never wait on Elsevier
+
+Each job moves through the stages in JOBSTAGES - validating the submitted tokens with
+Elsevier, saving them to the deployment's config.json and resetting the passcode - and
+records its progress in its own job file so any web process can report it
+
+Job ID is derived from the deployment, passcode and submitted values, so a duplicate
+submission of the same form returns the existing job rather than starting another one.
+Job files are only changed while holding JOBSLOCKFILE, a stage that has finished is never
+run again and only the thread running a job's latest attempt can change it, so tokens are
+never saved or passcode reset twice
+
+Submitted tokens are removed from the job file once saved or once the job fails, and job
+files are only readable by the Apache system user
+"""
+
+import os
+import time
+import json
+import fcntl
+import hashlib
+import secrets
+import tempfile
+import threading
+from contextlib import contextmanager
+from scopusauthtokens.tokenchecker import tokenchecker
+from scopusauthtokens.passcode import passcode
+from scopusauthtokens.tracing import span, wrap
+from scopusauthtokens.events import event
+
+# Location of folder containing job files
+JOBSDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "jobs")
+
+# Lock file held while creating jobs and saving tokens
+JOBSLOCKFILE = os.path.join(JOBSDIR, "jobs.lock")
+
+# Stages each job moves through in order
+STAGEVALIDATING = 'validating'
+STAGESAVING = 'saving'
+STAGERESETTING = 'resetting'
+JOBSTAGES = [STAGEVALIDATING, STAGESAVING, STAGERESETTING]
+
+# States of job in addition to stage currently running
+STATEQUEUED = 'queued'
+STATEDONE = 'done'
+STATEFAILED = 'failed'
+
+# Error when job's reset link was used by another job or replaced before tokens were saved
+ERRORLINKUSED = "Reset link has already been used or replaced - please request a new link"
+
+# Time in seconds after which unfinished job that hasn't progressed is treated as interrupted
+JOBSTALLEDTIME = 10 * 60
+
+# Time in seconds finished job files are kept before being removed
+JOBRETENTION = 7 * 24 * 60 * 60
+
+
+def jobid(deployment, userpasscode, apikey, insttoken, expirydate):
+    """
+    Get ID of job for submitted values - same submission always gives same ID
+    """
+
+    values = json.dumps([deployment, userpasscode, apikey, insttoken, expirydate])
+    return hashlib.sha256(values.encode('utf-8')).hexdigest()[:32]
+
+def passcodehash(userpasscode):
+    """
+    Hash of passcode stored in job file so passcode itself isn't stored
+    """
+
+    return hashlib.sha256(userpasscode.encode('utf-8')).hexdigest()
+
+def jobfile(id):
+    """
+    Location of job's file
+    """
+
+    return os.path.join(JOBSDIR, id + '.json')
+
+def isjobid(id):
+    """
+    Checks whether id is well-formed job ID
+    """
+
+    return (len(id) == 32) and all(c in '0123456789abcdef' for c in id)
+
+@contextmanager
+def jobslock():
+    """
+    Hold lock shared by all threads and processes creating jobs or saving tokens
+    """
+
+    with open(JOBSLOCKFILE, 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+def readjob(id):
+    """
+    Get job's stored state or None if job doesn't exist
+    """
+
+    try:
+        with open(jobfile(id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def writejob(job):
+    """
+    Write job's state to temporary file then move into place so readers never see partial file
+    """
+
+    job['UPDATED'] = time.time()
+    fd, tempfilename = tempfile.mkstemp(dir=JOBSDIR)
+    try:
+        # Temporary file is created readable by owner only
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(tempfilename, jobfile(job['JOBID']))
+    except BaseException:
+        os.remove(tempfilename)
+        raise
+
+class supersededjob(Exception):
+    """
+    Raised when job has been resumed by another thread so this thread must stop changing it
+    """
+
+@contextmanager
+def ownedjob(id, attempt):
+    """
+    Hold jobs lock and get job's current state from its file, as long as attempt is still job's latest attempt
+    """
+
+    with jobslock():
+        job = readjob(id)
+        if (job is None) or (job['ATTEMPT'] != attempt):
+            raise supersededjob(id)
+        yield job
+
+def isstalled(job):
+    """
+    Checks whether unfinished job has stopped progressing, eg. because its process was restarted
+    """
+
+    return (job['STATE'] not in (STATEDONE, STATEFAILED)) and (time.time() >= job['UPDATED'] + JOBSTALLEDTIME)
+
+def removeoldjobs():
+    """
+    Remove job files that haven't been updated within JOBRETENTION
+    """
+
+    for filename in os.listdir(JOBSDIR):
+        if filename.endswith('.json') is False: continue
+        try:
+            if time.time() >= os.path.getmtime(os.path.join(JOBSDIR, filename)) + JOBRETENTION:
+                os.remove(os.path.join(JOBSDIR, filename))
+        except FileNotFoundError:
+            pass
+
+def jobstatus(id):
+    """
+    Get job's progress and verdict suitable for returning to browser or None if job doesn't exist
+    Submitted tokens aren't included
+    """
+
+    job = readjob(id)
+    if job is None: return None
+
+    state, error = job['STATE'], job['ERROR']
+    if isstalled(job):
+        state, error = STATEFAILED, "Job was interrupted - please submit authentication tokens again"
+
+    return {'jobid': job['JOBID'], 'deployment': job['DEPLOYMENT'], 'state': state, \
+            'stages': [{'name': stage, 'started': job['STAGES'][stage]['STARTED'], 'finished': job['STAGES'][stage]['FINISHED']} \
+                       for stage in JOBSTAGES], \
+            'finished': state in (STATEDONE, STATEFAILED), 'success': state == STATEDONE, \
+            'error': error, 'detail': job['DETAIL'], 'created': job['CREATED'], 'updated': job['UPDATED']}
+
+def submit(deployment, userpasscode, apikey, insttoken, expirydate):
+    """
+    Submit tokens to be validated, saved and passcode reset by background job
+
+    Returns (job ID, whether new job was started). If same values have already been submitted,
+    existing job is returned - unless it failed or was interrupted, in which case it is resumed
+    from first stage that didn't finish as new attempt
+    """
+
+    id = jobid(deployment, userpasscode, apikey, insttoken, expirydate)
+    with jobslock():
+        job = readjob(id)
+        if (job is not None) and (job['STATE'] != STATEFAILED) and (isstalled(job) is False):
+            event('job.duplicate', deployment=deployment, jobid=id, state=job['STATE'])
+            return id, False
+
+        if job is None:
+            removeoldjobs()
+            job = {'JOBID': id, 'DEPLOYMENT': deployment, 'PASSCODEHASH': passcodehash(userpasscode), \
+                   'EXPIRYDATE': expirydate, \
+                   'STAGES': {stage: {'STARTED': None, 'FINISHED': None} for stage in JOBSTAGES}, \
+                   'DETAIL': '', 'CREATED': time.time()}
+        if job['STAGES'][STAGESAVING]['FINISHED'] is None:
+            # Tokens are removed when job fails so are restored from submission, which has same job ID
+            job['APIKEY'], job['INSTTOKEN'] = apikey, insttoken
+        job['STATE'], job['ERROR'], job['ATTEMPT'] = STATEQUEUED, '', secrets.token_hex(8)
+        writejob(job)
+
+    event('job.submitted', deployment=deployment, jobid=id)
+    threading.Thread(target=wrap(runjob), args=(id, job['ATTEMPT']), name='tokenupdate-' + id).start()
+    return id, True
+
+def runjob(id, attempt):
+    """
+    Run job's unfinished stages in order, recording progress and any failure in job file
+
+    Job is reread from its file under jobs lock before every change so progress made by
+    other threads is never overwritten - if job has been resumed as newer attempt, stops
+    """
+
+    with span('job.run', jobid=id):
+        try:
+            with ownedjob(id, attempt) as job:
+                deployment = job['DEPLOYMENT']
+                validate = job['STAGES'][STAGEVALIDATING]['FINISHED'] is None
+                if validate:
+                    apikey, insttoken = job['APIKEY'], job['INSTTOKEN']
+                    startstage(job, STAGEVALIDATING)
+
+            # Validating with Elsevier may be slow so lock isn't held while waiting for response
+            if validate:
+                newtokenchecker = tokenchecker(deployment, loadtokens=False)
+                newtokenchecker.settokens(apikey, insttoken)
+                tokencheckerresults = newtokenchecker.run()
+                event('check.result', deployment=deployment, success=tokencheckerresults['SUCCESS'], \
+                      data=tokencheckerresults['DATA'], submitted=True, jobid=id)
+                with ownedjob(id, attempt) as job:
+                    job['DETAIL'] = tokencheckerresults['DATA']
+                    if tokencheckerresults['SUCCESS'] is False:
+                        return failjob(job, "Authentication tokens not valid")
+                    finishstage(job, STAGEVALIDATING)
+
+            # Saving and resetting run under lock so two jobs using same passcode can't both save
+            with ownedjob(id, attempt) as job:
+                latestpasscode = passcode(deployment)
+                if job['STAGES'][STAGESAVING]['FINISHED'] is None:
+                    if passcodehash(latestpasscode.CURRENTPASSCODE) != job['PASSCODEHASH']:
+                        return failjob(job, ERRORLINKUSED)
+                    startstage(job, STAGESAVING)
+                    tokenchecker(deployment).savetokens(job['APIKEY'], job['INSTTOKEN'], job['EXPIRYDATE'])
+                    finishstage(job, STAGESAVING)
+
+                if job['STAGES'][STAGERESETTING]['FINISHED'] is None:
+                    startstage(job, STAGERESETTING)
+                    latestpasscode.reset()
+                    finishstage(job, STAGERESETTING)
+
+                job['STATE'] = STATEDONE
+                writejob(job)
+                event('job.finished', deployment=deployment, jobid=id, success=True)
+
+        except supersededjob:
+            event('job.superseded', jobid=id, attempt=attempt)
+        except Exception as e:
+            try:
+                with ownedjob(id, attempt) as job:
+                    failjob(job, repr(e))
+            except supersededjob:
+                event('job.superseded', jobid=id, attempt=attempt)
+
+def startstage(job, stage):
+    """
+    Record job has started stage
+    """
+
+    job['STATE'] = stage
+    job['STAGES'][stage]['STARTED'] = time.time()
+    writejob(job)
+
+def finishstage(job, stage):
+    """
+    Record job has finished stage so it is never run again
+    Submitted tokens are no longer needed once saved so are removed
+    """
+
+    job['STAGES'][stage]['FINISHED'] = time.time()
+    if stage == STAGESAVING:
+        job.pop('APIKEY', None)
+        job.pop('INSTTOKEN', None)
+    writejob(job)
+
+def failjob(job, error):
+    """
+    Record job has failed with error, removing submitted tokens
+    """
+
+    job['STATE'], job['ERROR'] = STATEFAILED, error
+    job.pop('APIKEY', None)
+    job.pop('INSTTOKEN', None)
+    writejob(job)
+    event('job.finished', deployment=job['DEPLOYMENT'], jobid=job['JOBID'], success=False, error=error)
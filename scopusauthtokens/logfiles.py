@@ -0,0 +1,102 @@
+"""
+Library for appending to rotating JSON lines files shared by several processes, eg. the
+event log and trace file written by every Apache process and the cron task
+
+Each write holds an exclusive lock on the file's folder, so only one process rotates the file
+and writes are never interleaved. Before writing, the file is rotated if it has reached its
+maximum size or, for daily files, was last written on an earlier day. Each process then reopens
+the file if another process has rotated it, so nothing is written to rotated files
+"""
+
+import os
+import fcntl
+import threading
+import pwd
+import grp
+from datetime import date
+import adminconfig
+
+
+class rotatingfile():
+    """
+    Class to append text to file, rotating it as filename.1, filename.2, ... safely across processes
+    """
+
+    def __init__(self, filename, maxbytes, backups, daily=False):
+        """
+        Init rotating file - file isn't opened until first write
+        """
+
+        self.filename = filename
+        self.maxbytes = maxbytes
+        self.backups = backups
+        self.daily = daily
+        self.stream = None
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        """
+        Append text to file, rotating and reopening file first if required
+        """
+
+        with self.lock:
+            folder = os.open(os.path.dirname(self.filename), os.O_RDONLY)
+            try:
+                fcntl.flock(folder, fcntl.LOCK_EX)
+                self.rotate()
+                self.reopen()
+                self.stream.write(text)
+                self.stream.flush()
+            finally:
+                os.close(folder)
+
+    def rotate(self):
+        """
+        Rotate file if it has reached maxbytes or daily file was last written before today
+        """
+
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return
+
+        if stat.st_size == 0: return
+        due = stat.st_size >= self.maxbytes
+        if self.daily and (date.fromtimestamp(stat.st_mtime) < date.today()): due = True
+        if due is False: return
+
+        for backup in range(self.backups - 1, 0, -1):
+            source = self.filename + '.' + str(backup)
+            if os.path.isfile(source):
+                os.replace(source, self.filename + '.' + str(backup + 1))
+        os.replace(self.filename, self.filename + '.1')
+
+    def reopen(self):
+        """
+        Open file if not open or if file at filename is no longer the one this process has open
+        """
+
+        if self.stream is not None:
+            try:
+                if os.stat(self.filename).st_ino == os.fstat(self.stream.fileno()).st_ino: return
+            except FileNotFoundError:
+                pass
+            self.stream.close()
+
+        isnew = os.path.isfile(self.filename) is False
+        self.stream = open(self.filename, 'a')
+        if isnew and (os.geteuid() == 0):
+            # Change owner of new file so Apache can append to it
+            uid = pwd.getpwnam(adminconfig.WWW_USER).pw_uid
+            gid = grp.getgrnam(adminconfig.WWW_USER).gr_gid
+            os.chown(self.filename, uid, gid)
+
+    def close(self):
+        """
+        Close file
+        """
+
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
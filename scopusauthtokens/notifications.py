@@ -0,0 +1,155 @@
+"""
+Library to manage notifications sent to admin contact about authentication tokens
+
+Records which condition was last notified, when, and at which stage of the escalation
+schedule so the daily token check only emails the admin contact when the condition
+changes or the next stage of the schedule is reached. Checks that don't result in a
+notification are recorded and folded into a digest in the next notification sent
+"""
+
+import os
+import time
+import json
+from datetime import datetime
+import adminconfig
+from scopusauthtokens.tokenchecker import EXPIRYREMINDERWINDOW
+from scopusauthtokens.deployments import statefile
+
+# Location of notifications state file
+NOTIFICATIONSFILE = 'notifications.json'
+
+# Conditions that notifications can be sent for
+CONDITIONOK = 'OK'
+CONDITIONEXPIRING = 'EXPIRING'
+CONDITIONFAILED = 'FAILED'
+
+# Number of days before expiry date at which escalating reminders are sent
+# Once tokens have expired or failed, reminders are sent every DAILYREMINDERINTERVAL
+REMINDERSCHEDULE = getattr(adminconfig, 'REMINDERSCHEDULE', [EXPIRYREMINDERWINDOW, 14, 7, 3, 1])
+
+# Stage of escalation schedule after which reminders are sent daily
+STAGEDAILY = 0
+
+# Time between daily reminders in seconds - allows for drift in cron start time
+DAILYREMINDERINTERVAL = (24 - 1) * 60 * 60
+
+# Maximum number of suppressed checks kept for digest
+MAXDIGESTENTRIES = 60
+
+# Notifications state file is created when first used so importing module has no side effects
+NOTIFICATIONSFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "notifications", NOTIFICATIONSFILE)
+
+
+def expirystage(expirydate):
+    """
+    Get stage of escalation schedule for tokens expiring on expirydate
+    Stage is smallest number of days in REMINDERSCHEDULE not less than days remaining
+    or None if expiry date is further away than first stage of REMINDERSCHEDULE
+    """
+
+    daysleft = (datetime.strptime(expirydate, '%Y-%m-%d') - datetime.now()).days + 1
+    if daysleft <= 0:
+        return STAGEDAILY
+    stages = [days for days in sorted(REMINDERSCHEDULE) if days >= daysleft]
+    if len(stages) == 0:
+        return None
+    return stages[0]
+
+
+class notifications():
+    """
+    Class to manage notification state
+    """
+
+    def __init__(self, deployment=None):
+        """
+        Init class using deployment's notifications state file
+        """
+
+        self.notificationsfile = statefile(NOTIFICATIONSFILE, deployment, \
+            {'CONDITION': CONDITIONOK, 'DETAIL': '', 'STAGE': None, 'LASTSENT': 0, 'SUPPRESSED': []})
+        self.refreshfromstore()
+
+    def refreshfromstore(self):
+        """
+        Load values from notifications state file
+        """
+
+        with open(self.notificationsfile) as f:
+            state = json.load(f)
+        self.CONDITION = state['CONDITION']
+        self.DETAIL = state['DETAIL']
+        self.STAGE = state['STAGE']
+        self.LASTSENT = float(state['LASTSENT'])
+        self.SUPPRESSED = state['SUPPRESSED']
+
+    def expirystage(self, expirydate):
+        """
+        Get stage of escalation schedule for tokens expiring on expirydate
+        """
+
+        return expirystage(expirydate)
+
+    def shouldnotify(self, condition, detail, stage=STAGEDAILY):
+        """
+        Checks whether notification should be sent for condition
+
+        Notification is due if condition or its detail (expiry date/error message) has changed,
+        if next stage of escalation schedule has been reached or if daily reminder is due
+        If no notification is due, check is recorded for digest in next notification
+        """
+
+        self.refreshfromstore()
+
+        # Expiry date not yet within REMINDERSCHEDULE
+        if (condition == CONDITIONEXPIRING) and (stage is None): return False
+
+        if condition == CONDITIONOK:
+            if self.CONDITION != CONDITIONOK:
+                self.CONDITION, self.DETAIL, self.STAGE, self.SUPPRESSED = CONDITIONOK, '', None, []
+                self.update()
+            return False
+
+        if (condition != self.CONDITION) or (detail != self.DETAIL): return True
+        if stage != self.STAGE: return True
+        if (stage == STAGEDAILY) and (time.time() >= self.LASTSENT + DAILYREMINDERINTERVAL): return True
+
+        self.SUPPRESSED.append({'TIME': str(datetime.now())[:16], 'CONDITION': condition, 'DETAIL': detail})
+        self.SUPPRESSED = self.SUPPRESSED[-MAXDIGESTENTRIES:]
+        self.update()
+        return False
+
+    def digest(self):
+        """
+        Summary of checks since last notification that didn't result in notification
+        """
+
+        if len(self.SUPPRESSED) == 0: return ''
+
+        lastsent = datetime.fromtimestamp(self.LASTSENT).strftime('%Y-%m-%d %H:%M')
+        digest = "Since the last notification on " + lastsent + ", " + str(len(self.SUPPRESSED)) + \
+                 " further check(s) found the same problem without sending a notification:\n"
+        for entry in self.SUPPRESSED:
+            digest += entry['TIME'] + " " + entry['CONDITION'] + ": " + entry['DETAIL'] + "\n"
+        return digest
+
+    def notified(self, condition, detail, stage=STAGEDAILY):
+        """
+        Record notification has been sent for condition
+        """
+
+        self.CONDITION = condition
+        self.DETAIL = detail
+        self.STAGE = stage
+        self.LASTSENT = time.time()
+        self.SUPPRESSED = []
+        self.update()
+
+    def update(self):
+        """
+        Write notification state to notifications state file
+        """
+
+        with open(self.notificationsfile, 'w') as f:
+            json.dump({'CONDITION': self.CONDITION, 'DETAIL': self.DETAIL, 'STAGE': self.STAGE, \
+                       'LASTSENT': self.LASTSENT, 'SUPPRESSED': self.SUPPRESSED}, f, indent=4)
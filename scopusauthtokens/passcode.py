@@ -11,9 +11,9 @@ import os
 import time
 import json
 import secrets
-import pwd
-import grp
-import adminconfig
+from scopusauthtokens.deployments import statefile
+from scopusauthtokens.tracing import traced
+from scopusauthtokens.events import event
 
 # Location of current passcode file
 PASSCODEFILE = 'passcode.json'
@@ -24,18 +24,14 @@ PASSCODERESET = ''
 # Expiry time of passcode in minutes 
 PASSCODEEXPIRYTIME = 24 * 60
 
+# Minimum remaining lifetime of passcode in minutes for it to be reused in new reset links
+PASSCODEREUSEMINIMUM = 12 * 60
+
 # Time between passcode checks in seconds to prevent brute-force attacks
 PASSCODETIMEDELAYS = 1
 
-# Create current passcode file if not exists
+# Current passcode file is created when first used so importing module has no side effects
 PASSCODEFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "passcode", PASSCODEFILE)
-if os.path.isfile(PASSCODEFILE) is False:
-    with open(PASSCODEFILE, 'w') as f:
-        json.dump({'CURRENTPASSCODE': PASSCODERESET, 'MODIFIED': str(time.time()), 'LASTCHECKED': str(time.time())}, f, indent=4)
-    # Change file owner so Apache can modify
-    uid = pwd.getpwnam(adminconfig.WWW_USER).pw_uid
-    gid = grp.getgrnam(adminconfig.WWW_USER).gr_gid
-    os.chown(PASSCODEFILE, uid, gid)
 
 
 class passcode():
@@ -43,24 +39,29 @@ class passcode():
     Class to manage passcode
     """
 
-    def __init__(self):
+    def __init__(self, deployment=None):
         """
-        Init class
+        Init class using deployment's passcode file
         """
 
+        self.deployment = deployment
+        self.passcodefile = statefile(PASSCODEFILE, deployment, \
+            {'CURRENTPASSCODE': PASSCODERESET, 'MODIFIED': str(time.time()), 'LASTCHECKED': str(time.time())})
         self.refreshfromstore()
 
+    @traced('passcode.refreshfromstore')
     def refreshfromstore(self):
         """
         Load values from current passcode file
         """
 
-        f = open(PASSCODEFILE)
+        f = open(self.passcodefile)
         currentpasscode = json.load(f)
         self.CURRENTPASSCODE = currentpasscode['CURRENTPASSCODE']
         self.MODIFIED = float(currentpasscode['MODIFIED'])
         self.LASTCHECKED = float(currentpasscode['LASTCHECKED'])
 
+    @traced('passcode.create')
     def create(self):
         """
         Create live one-time passcode and save to passcode store
@@ -71,16 +72,34 @@ class passcode():
         self.MODIFIED = time.time()
         self.LASTCHECKED = time.time()
         self.update()        
+        event('passcode.created', deployment=self.deployment)
 
         return self.CURRENTPASSCODE
 
-    def getresetlink(self, baseurl):
+    def getresetlink(self, baseurl, reuse=False):
         """
         Creates reset link using supplied baseurl
+
+        If reuse, current passcode is used instead of creating new passcode as long as 
+        it remains valid for at least PASSCODEREUSEMINIMUM - so previously sent links still work
         """
 
+        if reuse and self.isreusable():
+            event('passcode.reused', deployment=self.deployment)
+            return baseurl + '/' + self.CURRENTPASSCODE
         return baseurl + '/' + self.create()
 
+    def isreusable(self):
+        """
+        Checks whether current passcode is live and not due to expire within PASSCODEREUSEMINIMUM
+        """
+
+        self.refreshfromstore()
+        if self.CURRENTPASSCODE == PASSCODERESET: return False
+        if (time.time() >= (self.MODIFIED + (60 * (PASSCODEEXPIRYTIME - PASSCODEREUSEMINIMUM)))):
+            return False
+        return True
+
     def isexpired(self):
         """
         Checks whether passcode has expired using PASSCODEEXPIRYTIME
@@ -91,6 +110,7 @@ class passcode():
             return True
         return False
     
+    @traced('passcode.isvalid')
     def isvalid(self, testpasscode):
         """
         Test for valid passcode against stored passcode ignoring expiry
@@ -108,10 +128,11 @@ class passcode():
         self.update()
 
         # Carry out checking of testpasscode
-        if testpasscode == PASSCODERESET: return False
-        if self.CURRENTPASSCODE == testpasscode: return True
-        return False
+        valid = (testpasscode != PASSCODERESET) and (self.CURRENTPASSCODE == testpasscode)
+        event('passcode.checked', deployment=self.deployment, valid=valid)
+        return valid
         
+    @traced('passcode.reset')
     def reset(self):
         """
         Reset one-time passcode
@@ -122,11 +143,13 @@ class passcode():
         self.CURRENTPASSCODE = PASSCODERESET
         self.MODIFIED = self.LASTCHECKED = time.time()
         self.update()
+        event('passcode.reset', deployment=self.deployment)
 
+    @traced('passcode.update')
     def update(self):
         """
         Write one-time passcode to passcode store
         """
 
-        with open(PASSCODEFILE, 'w') as f:
+        with open(self.passcodefile, 'w') as f:
             json.dump({'CURRENTPASSCODE': self.CURRENTPASSCODE, 'MODIFIED': self.MODIFIED, 'LASTCHECKED': self.LASTCHECKED}, f, indent=4)
@@ -10,52 +10,134 @@ import sys
 import os
 import json
 import time
-import pwd
-import grp
+import hashlib
+import threading
 import requests
-from datetime import datetime, timedelta
+import requests.adapters
+from http.cookiejar import DefaultCookiePolicy
+from datetime import date, datetime, timedelta
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),os.path.pardir, os.path.pardir))
 xrisk_dir = os.path.abspath(os.path.join(parent_dir, 'x-risk'))
 sys.path.append(parent_dir)
 sys.path.append(xrisk_dir)
 
-import adminconfig
+from scopusauthtokens.deployments import xriskdir, statefile
+from scopusauthtokens.tracing import span, traced
+from scopusauthtokens.events import event
+
+# Elsevier Scopus search endpoint used to test tokens
+ELSEVIERBASEURL = u'https://api.elsevier.com/content/search/scopus/'
+
+# Timeout in seconds for opening connection to Elsevier during warm-up
+WARMUPTIMEOUT = 10
+
+# Timeout in seconds for connecting to and each read from Elsevier when checking tokens
+# Must be well below jobs.JOBSTALLEDTIME so token update jobs never appear stalled while waiting
+ELSEVIERTIMEOUT = 60
+
+# Pool of HTTP connections to Elsevier shared by all threads in process - urllib3 connection pools are thread-safe
+ADAPTER = requests.adapters.HTTPAdapter()
+
+# Each thread has its own session using shared ADAPTER
+sessions = threading.local()
 
 # Number of days before token expiry date to start sending reminders
 EXPIRYREMINDERWINDOW = 30
 
+# Location of X-Risk config file containing Elsevier authentication tokens and expiry date
+CONFIGFILE = os.path.join(parent_dir, "x-risk/config.json")
+
 # Location of tokenchecker file that caches most recent live test run of tokens
 TOKENCHECKERFILE = 'tokenchecker.json'
 
-# Create tokenchecker file file if not exists
+# Tokenchecker file is created when first used so importing module has no side effects
 TOKENCHECKERFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tokenchecker", TOKENCHECKERFILE)
-if os.path.isfile(TOKENCHECKERFILE) is False:
-    with open(TOKENCHECKERFILE, 'w') as f:
-        json.dump({'SUCCESS': True, 'LASTSAVED': str(datetime.now())}, f, indent=4)
-    # Change file owner so Apache can modify
-    uid = pwd.getpwnam(adminconfig.WWW_USER).pw_uid
-    gid = grp.getgrnam(adminconfig.WWW_USER).gr_gid
-    os.chown(TOKENCHECKERFILE, uid, gid)
+
+def configfile(deployment=None):
+    """
+    Location of deployment's X-Risk config file
+    """
+
+    if deployment is None: return CONFIGFILE
+    return os.path.join(xriskdir(deployment), "config.json")
+
+def cachefile(deployment=None):
+    """
+    Location of deployment's tokenchecker file, creating it if not exists
+    """
+
+    return statefile(TOKENCHECKERFILE, deployment, {'SUCCESS': True, 'LASTSAVED': str(datetime.now())})
+
+def session():
+    """
+    Get current thread's session for requests to Elsevier
+
+    Session never stores cookies so one set of tokens' cookies are never sent with another's,
+    eg. when validatetokens.py checks several candidate pairs on same thread
+    """
+
+    if not hasattr(sessions, 'session'):
+        newsession = requests.Session()
+        newsession.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        newsession.mount('https://', ADAPTER)
+        sessions.session = newsession
+    return sessions.session
+
+def warmconnection():
+    """
+    Open TLS connection to Elsevier so first check in process doesn't pay for connection setup
+    Request doesn't include authentication tokens so doesn't count against API quota
+    """
+
+    session().head(ELSEVIERBASEURL, timeout=WARMUPTIMEOUT)
+
+def statusversion(deployment=None):
+    """
+    Get version of deployment's current token status and time it was last modified
+
+    Version changes whenever cached token status or stored tokens/expiry date change 
+    and at start of every day (as tokens may then fall within EXPIRYREMINDERWINDOW)
+    Only file metadata is read so it is cheap enough to call on every request
+    """
+
+    today = date.today()
+    tokencheckerstat = os.stat(cachefile(deployment))
+    configstat = os.stat(configfile(deployment))
+    versionkey = "%s:%d:%d:%d:%d:%s" % (deployment, tokencheckerstat.st_mtime_ns, tokencheckerstat.st_size, \
+                                        configstat.st_mtime_ns, configstat.st_size, today.isoformat())
+    version = hashlib.sha1(versionkey.encode('utf-8')).hexdigest()[:20]
+
+    startofday = time.mktime(today.timetuple())
+    lastmodified = max(tokencheckerstat.st_mtime, configstat.st_mtime, startofday)
+
+    return version, int(lastmodified)
 
 """
 Class for managing token checking
 """
 class tokenchecker():
 
-    def __init__(self):
+    def __init__(self, deployment=None, loadtokens=True):
         """
-        Initialize class including loading stored API credentials
+        Initialize class including loading deployment's stored API credentials
+        If not loadtokens, credentials must be supplied using settokens()
         """
 
-        self.base_url = u'https://api.elsevier.com/content/search/scopus/'
+        self.base_url = ELSEVIERBASEURL
         self.elsversion = '0.3.2'
         self.testquery = "TITLE-ABS-KEY%28%22human+extinction%22%29+AND+PUBYEAR+%3D+2000&view=COMPLETE"
         self.actualtokens = True
+        self.deployment = deployment
+        self.configfile = configfile(deployment)
+        self.apikey = self.insttoken = self.expirydate = None
+
+        if loadtokens is False:
+            self.actualtokens = False
+            return
 
         # Load stored Elsevier API credentials by default
-        config_file = os.path.join(parent_dir, "x-risk/config.json")
-        with open(config_file, 'r') as f:
+        with open(self.configfile, 'r') as f:
             elsevierconfig = json.load(f)
             self.apikey = elsevierconfig['apikey']
             self.insttoken = elsevierconfig['insttoken']
@@ -70,6 +152,7 @@ class tokenchecker():
         self.insttoken = insttoken
         self.actualtokens = False
 
+    @traced('tokenchecker.savetokens')
     def savetokens(self, apikey, insttoken, expirydate):
         """
         Save credentials
@@ -80,31 +163,34 @@ class tokenchecker():
         self.expirydate = expirydate
         self.actualtokens = True
 
-        config_file = os.path.join(parent_dir, "x-risk/config.json")
-        with open(config_file, 'w') as f:
+        with span('config.write'), open(self.configfile, 'w') as f:
             json.dump({'apikey': apikey, 'insttoken': insttoken, 'expirydate': expirydate}, f, indent=4)
 
+        event('tokens.saved', deployment=self.deployment, expirydate=expirydate)
+
         # We're only saving tokens that have been successfully verified
         self.statustocache(True)
 
+    @traced('tokenchecker.cachedstatus')
     def cachedstatus(self):
         """
         Get lastest run of call to Elsevier API using cache file        
         """
 
         parsed_json = {'SUCCESS': False}
-        with open(TOKENCHECKERFILE) as f:
+        with open(cachefile(self.deployment)) as f:
             parsed_json = json.load(f)
 
         return parsed_json            
 
+    @traced('tokenchecker.statustocache')
     def statustocache(self, success):
         """
         Cache latest run to prevent excessive calls to Elsevier API
         """
 
         if (self.actualtokens):
-            with open(TOKENCHECKERFILE, 'w') as f:
+            with open(cachefile(self.deployment), 'w') as f:
                 json.dump({'SUCCESS': success, 'LASTSAVED': str(datetime.now())}, f, indent=4)
 
     def expiressoon(self):
@@ -118,6 +204,7 @@ class tokenchecker():
             return True
         return False
 
+    @traced('tokenchecker.run')
     def run(self):
         """
         Run token checker
@@ -133,12 +220,16 @@ class tokenchecker():
             "Accept"        : 'application/json'
             }
         if self.insttoken: headers["X-ELS-Insttoken"] = self.insttoken
-        r = requests.get(
-            url,
-            headers = headers
-            )
+        with span('elsevier.request') as requestspan:
+            r = session().get(
+                url,
+                headers = headers,
+                timeout = ELSEVIERTIMEOUT
+                )
+            requestspan.tag('http.status_code', r.status_code)
         if r.status_code == 200:
-            results = json.loads(r.text)
+            with span('json.parse'):
+                results = json.loads(r.text)
 
             # We check first entry to see if it has 'dc:description' field
             firstentry = results['search-results']['entry'][0]
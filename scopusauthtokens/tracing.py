@@ -0,0 +1,323 @@
+"""
+Library for lightweight span-based tracing of web requests, token checks, passcode operations
+and email delivery so slow token updates can be broken down into their component timings
+
+Spans record name, timing, tags and parent/child relationship and are exported in batches by
+a background thread to a rotating file of JSON lines in Zipkin v2 span format, eg:
+
+with span('smtp.send', deployment='staging'):
+    ...
+
+@traced('passcode.create')
+def create(self):
+    ...
+
+Proportion of new traces sampled is set by adminconfig.TRACESAMPLERATE (0 = off, 1 = all)
+When tracing is off, span() returns a shared no-op span so overhead is a single comparison
+
+Spans are tracked per thread - use wrap() to continue current trace in background thread
+"""
+
+import os
+import time
+import json
+import random
+import atexit
+import threading
+import functools
+import adminconfig
+from scopusauthtokens.events import event
+from scopusauthtokens.logfiles import rotatingfile
+
+# Proportion of new traces that are sampled and exported
+TRACESAMPLERATE = float(getattr(adminconfig, 'TRACESAMPLERATE', 0))
+
+# Location of trace file
+TRACEFILE = 'traces.jsonl'
+TRACEFILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tracing", TRACEFILE)
+
+# Size in bytes at which trace file is rotated and number of rotated files kept
+TRACEFILEMAXBYTES = 5 * 1024 * 1024
+TRACEFILEBACKUPS = 3
+
+# Number of finished spans that triggers export and maximum time in seconds between exports
+TRACEBATCHSIZE = 100
+TRACEFLUSHINTERVAL = 5
+
+# Maximum number of finished spans waiting for export - further spans are dropped
+TRACEMAXPENDING = 10000
+
+# Service name recorded against every span
+TRACESERVICENAME = 'x-risk-admin'
+
+# Stack of active spans for current thread
+local = threading.local()
+
+
+def activespans():
+    """
+    Get stack of active spans for current thread
+    """
+
+    if not hasattr(local, 'spans'):
+        local.spans = []
+    return local.spans
+
+def currentspan():
+    """
+    Get innermost active span for current thread or None
+    """
+
+    spans = activespans()
+    if len(spans) == 0: return None
+    return spans[-1]
+
+
+class noopspan():
+    """
+    Span returned when tracing is off or trace isn't sampled
+    """
+
+    sampled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def start(self):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def tag(self, key, value):
+        pass
+
+NOOPSPAN = noopspan()
+
+
+class tracespan():
+    """
+    Class to record single timed operation within trace
+    """
+
+    def __init__(self, name, parent, tags):
+        """
+        Init span as child of parent span or as root of new trace if no parent
+        """
+
+        self.name = name
+        self.tags = tags
+        self.parentid = None
+        if parent is None:
+            self.traceid = '%032x' % random.getrandbits(128)
+            self.sampled = random.random() < TRACESAMPLERATE
+        else:
+            self.traceid = parent.traceid
+            self.parentid = parent.spanid
+            self.sampled = parent.sampled
+        self.spanid = '%016x' % random.getrandbits(64)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.finish(exc)
+        return False
+
+    def start(self):
+        """
+        Start timing span and make it current span for thread
+        """
+
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        activespans().append(self)
+        return self
+
+    def finish(self, error=None):
+        """
+        Stop timing span and export it if trace sampled
+        """
+
+        duration = time.perf_counter() - self.started
+        spans = activespans()
+        if self in spans: spans.remove(self)
+
+        if self.sampled is False: return
+        if error is not None: self.tags['error'] = repr(error)
+
+        record = {
+            'traceId': self.traceid,
+            'id': self.spanid,
+            'name': self.name,
+            'timestamp': int(self.timestamp * 1000000),
+            'duration': max(int(duration * 1000000), 1),
+            'localEndpoint': {'serviceName': TRACESERVICENAME},
+            'tags': {key: str(value) for key, value in self.tags.items()},
+        }
+        if self.parentid is not None: record['parentId'] = self.parentid
+        EXPORTER.export(record)
+
+    def tag(self, key, value):
+        """
+        Add tag to span
+        """
+
+        self.tags[key] = value
+
+
+class batchexporter():
+    """
+    Class to export finished spans in batches to rotating trace file using background thread
+    """
+
+    def __init__(self, filename):
+        """
+        Init exporter - background thread is only started once first span is exported
+        """
+
+        self.file = rotatingfile(filename, TRACEFILEMAXBYTES, TRACEFILEBACKUPS)
+        self.pending = []
+        self.dropped = 0
+        self.reporteddropped = 0
+        self.errors = 0
+        self.lasterror = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def export(self, record):
+        """
+        Queue finished span for export
+        """
+
+        with self.lock:
+            if len(self.pending) >= TRACEMAXPENDING:
+                self.dropped += 1
+                return
+            self.pending.append(record)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='tracing-exporter', daemon=True)
+                self.thread.start()
+            batchfull = len(self.pending) >= TRACEBATCHSIZE
+        if batchfull: self.wakeup.set()
+
+    def run(self):
+        """
+        Export pending spans whenever batch is full or TRACEFLUSHINTERVAL has passed
+        """
+
+        while True:
+            self.wakeup.wait(TRACEFLUSHINTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep exporting later batches, eg. once disk space is freed
+                with self.lock:
+                    self.errors += 1
+                    self.lasterror = repr(e)
+            self.reportdropped()
+
+    def flush(self):
+        """
+        Write all pending spans to trace file as JSON lines
+        """
+
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if len(batch) == 0: return
+
+        lines = ''.join(json.dumps(record) + '\n' for record in batch)
+        try:
+            self.file.write(lines)
+        except Exception:
+            # Spans in batch that couldn't be written are lost
+            with self.lock:
+                self.dropped += len(batch)
+            raise
+
+    def close(self):
+        """
+        Export remaining spans, recording rather than raising any write error
+        """
+
+        try:
+            self.flush()
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+                self.lasterror = repr(e)
+        self.reportdropped()
+
+    def reportdropped(self):
+        """
+        Record spans dropped since last report in event log, with most recent write error
+        """
+
+        with self.lock:
+            dropped = self.dropped - self.reporteddropped
+            self.reporteddropped = self.dropped
+            lasterror = self.lasterror
+        if dropped > 0:
+            event('tracing.dropped', dropped=dropped, total=self.dropped, errors=self.errors, lasterror=lasterror)
+
+EXPORTER = batchexporter(TRACEFILE)
+
+# Export remaining spans when process exits, eg. at end of cron task
+atexit.register(EXPORTER.close)
+
+
+def droppedspans():
+    """
+    Total number of spans dropped because too many were waiting for export or they couldn't be written
+    """
+
+    return EXPORTER.dropped
+
+def span(name, **tags):
+    """
+    Create span as child of current span, or as root of new trace if there's no current span
+    Use as context manager or call start() and finish() explicitly
+    """
+
+    if TRACESAMPLERATE <= 0: return NOOPSPAN
+
+    parent = currentspan()
+    if (parent is not None) and (parent.sampled is False): return NOOPSPAN
+    return tracespan(name, parent, tags)
+
+def traced(name):
+    """
+    Decorator to record every call of function as span
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if TRACESAMPLERATE <= 0: return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def wrap(function):
+    """
+    Wrap function so spans it creates when run in another thread are children of current span
+    """
+
+    parent = currentspan()
+    if parent is None: return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        spans = activespans()
+        spans.append(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            spans.remove(parent)
+    return wrapper
@@ -9,55 +9,63 @@ haselwimmer@gmail.com 17/01/2023
 import sys
 import os
 import smtplib
-from email import encoders
-from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from scopusauthtokens.passcode import passcode
-from scopusauthtokens.tokenchecker import tokenchecker, EXPIRYREMINDERWINDOW
+from scopusauthtokens.tokenchecker import tokenchecker
+from scopusauthtokens.notifications import notifications, CONDITIONOK, CONDITIONEXPIRING, CONDITIONFAILED, STAGEDAILY
+from scopusauthtokens.deployments import xriskdir, admincontactemail, adminurl, label
+from scopusauthtokens.fleet import checkall
+from scopusauthtokens.tracing import span, traced
+from scopusauthtokens.events import event
+from scopusauthtokens.instructions import instructionsattachment
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),os.path.pardir))
 xrisk_dir = os.path.abspath(os.path.join(parent_dir, 'x-risk'))
 sys.path.append(parent_dir)
 sys.path.append(xrisk_dir)
 
-import adminconfig
 import config
 
-# Location of lock file created if tokens aren't working
+# Name of lock file created in deployment's X-Risk folder if tokens aren't working
 TOKENFAILURELOCKFILE = 'TOKENSFAILED'
-TOKENFAILURELOCKFILE = os.path.join(xrisk_dir, TOKENFAILURELOCKFILE)
 
-# Location of instructions PDF file
-INSTRUCTIONS_FILE = "Instructions.pdf"  
-INSTRUCTIONS = os.path.join(os.path.dirname(__file__), INSTRUCTIONS_FILE)
+def htmldigest(digest):
+    """
+    Convert plain-text digest of previous checks to HTML
+    """
 
-def send_scopus_reminder_message_to_admin(expirydate):
+    if digest == '': return ''
+    return digest.replace("\n", "<br>\n") + "<br>"
+
+@traced('email.reminder')
+def send_scopus_reminder_message_to_admin(expirydate, digest='', deployment=None):
     """
-    Send reminder email to admin to obtain new authentication tokens
-    Email includes link for resetting tokens within system
+    Send reminder email to deployment's admin to obtain new authentication tokens
+    Email includes link for resetting tokens within system and digest of checks since last reminder
     """
     
     # Create message container - the correct MIME type is multipart/alternative.
     msg = MIMEMultipart('alternative')
-    msg['Subject'] = "URGENT: Elsevier Scopus authentication tokens for X-Risk/TERRA due to expire soon"
+    msg['Subject'] = "URGENT: Elsevier Scopus authentication tokens for " + label(deployment) + " due to expire soon"
     msg['From'] = config.EMAIL_HOST_USER
-    msg['To'] = adminconfig.ADMINCONTACTEMAIL
+    msg['To'] = admincontactemail(deployment)
 
-    # Create new passcode with expiry to easily allow admin user to change tokens
-    latestpasscode = passcode()
-    entertokensurl = latestpasscode.getresetlink(adminconfig.ADMINURL)
+    # Reuse still-valid passcode or create new passcode with expiry to easily allow admin user to change tokens
+    latestpasscode = passcode(deployment)
+    entertokensurl = latestpasscode.getresetlink(adminurl(deployment), reuse=True)
 
     # Create the body of the message (a plain-text and an HTML version).
     text = """Dear CSER Admin,
 
-The Elsevier API authentication tokens for the X-Risk/TERRA system are due to expire on """ + expirydate + """. 
+The Elsevier API authentication tokens for the """ + label(deployment) + """ system are due to expire on """ + expirydate + """. 
 
 Please follow the instructions in the attached "Instructions.pdf" file to obtain and implement new authentication tokens.
 
 Once you have obtained valid authentication tokens from Elsevier, click the following link to enter them into the X-Risk/TERRA system:
 """ + entertokensurl + """
 
+""" + digest + """
 Regards,
 
 X-Risk/TERRA Sysadmin System
@@ -69,13 +77,14 @@ X-Risk/TERRA Sysadmin System
     <head></head>
     <body>
         <p>Dear CSER Admin,<br><br>
-        The Elsevier API authentication tokens for the X-Risk/TERRA system are due to expire on """ + expirydate + """. 
+        The Elsevier API authentication tokens for the """ + label(deployment) + """ system are due to expire on """ + expirydate + """. 
         <br><br>
         Please follow the instructions in the attached "Instructions.pdf" file to obtain and implement new authentication tokens.
         <br><br>
         Once you have obtained valid authentication tokens from Elsevier, click the following link to enter them into the X-Risk/TERRA system:<br>
         """ + entertokensurl + """
         <br><br>
+        """ + htmldigest(digest) + """
         Regards,
         <br><br>
         X-Risk/TERRA Sysadmin System
@@ -95,24 +104,24 @@ X-Risk/TERRA Sysadmin System
     msg.attach(part2)
 
     # Add instructions attachment to email
-    with open(INSTRUCTIONS, "rb") as attachment:
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(attachment.read())
-    encoders.encode_base64(part)
-    part.add_header("Content-Disposition", f"attachment; filename= {INSTRUCTIONS_FILE}",)
-    msg.attach(part)
-
-    with smtplib.SMTP(config.EMAIL_HOST, config.EMAIL_PORT) as server:
+    msg.attach(instructionsattachment())
+
+    with span('smtp.send'), smtplib.SMTP(config.EMAIL_HOST, config.EMAIL_PORT) as server:
         server.ehlo()
         server.starttls()    
         server.login(config.EMAIL_HOST_USER, config.EMAIL_HOST_PASSWORD)
-        server.sendmail(config.EMAIL_HOST_USER, adminconfig.ADMINCONTACTEMAIL, msg.as_string())
+        server.sendmail(config.EMAIL_HOST_USER, admincontactemail(deployment), msg.as_string())
+    event('email.sent', deployment=deployment, kind='reminder', to=admincontactemail(deployment))
 
-def send_error_message_to_admin(tokenchecker, errormessage):
+@traced('email.error')
+def send_error_message_to_admin(tokenchecker, errormessage, digest=''):
     """
-    Send error message to admin email that current authentication tokens are invalid
+    Send error message to deployment's admin email that current authentication tokens are invalid
+    Email includes digest of checks since last error message
     """
 
+    deployment = tokenchecker.deployment
+
     localtest = 'curl --header "Accept: application/json" --header "User-Agent: elsapy-v' + tokenchecker.elsversion + '" '
     localtest += '--header "X-ELS-APIKey: ' + tokenchecker.apikey + '" '
     if tokenchecker.insttoken: 
@@ -122,12 +131,13 @@ def send_error_message_to_admin(tokenchecker, errormessage):
     # Create message container - the correct MIME type is multipart/alternative.
     msg = MIMEMultipart('alternative')
     msg['Subject'] = "Problem downloading Elsevier Scopus"
+    if deployment is not None: msg['Subject'] += " for " + label(deployment)
     msg['From'] = config.EMAIL_HOST_USER
-    msg['To'] = adminconfig.ADMINCONTACTEMAIL
+    msg['To'] = admincontactemail(deployment)
 
-    # Create new passcode with expiry to easily allow admin user to change tokens
-    latestpasscode = passcode()
-    entertokensurl = latestpasscode.getresetlink(adminconfig.ADMINURL)
+    # Reuse still-valid passcode or create new passcode with expiry to easily allow admin user to change tokens
+    latestpasscode = passcode(deployment)
+    entertokensurl = latestpasscode.getresetlink(adminurl(deployment), reuse=True)
 
     # Create the body of the message (a plain-text and an HTML version).
     text = """Dear CSER Admin,
@@ -151,6 +161,7 @@ To reproduce this error on a local computer, open command prompt and enter:
 
 If the above curl request is operating correctly, you should see lots of data including the 'dc:description' field. If 'dc:description' field is missing, that will create problems for xrisk.
 
+""" + digest + """
 Regards,
 
 X-Risk/TERRA Sysadmin System
@@ -180,6 +191,7 @@ X-Risk/TERRA Sysadmin System
     """ + localtest  + """
             </code><br><br>
         If the above curl request is operating correctly, you should see lots of data including the 'dc:description' field. If 'dc:description' field is missing, that will create problems for xrisk.<br><br>
+        """ + htmldigest(digest) + """
         Regards,<br><br>
         X-Risk/TERRA Sysadmin System<br>
         </p>  
@@ -198,19 +210,65 @@ X-Risk/TERRA Sysadmin System
     msg.attach(part2)
 
     # Add instructions attachment to email
-    with open(INSTRUCTIONS, "rb") as attachment:
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(attachment.read())
-    encoders.encode_base64(part)
-    part.add_header("Content-Disposition", f"attachment; filename= {INSTRUCTIONS_FILE}",)
-    msg.attach(part)
-
-    with smtplib.SMTP(config.EMAIL_HOST, config.EMAIL_PORT) as server:
+    msg.attach(instructionsattachment())
+
+    with span('smtp.send'), smtplib.SMTP(config.EMAIL_HOST, config.EMAIL_PORT) as server:
         server.ehlo()
         server.starttls()    
         # server.set_debuglevel(1)    
         server.login(config.EMAIL_HOST_USER, config.EMAIL_HOST_PASSWORD)
-        server.sendmail(config.EMAIL_HOST_USER, adminconfig.ADMINCONTACTEMAIL, msg.as_string())
+        server.sendmail(config.EMAIL_HOST_USER, admincontactemail(deployment), msg.as_string())
+    event('email.sent', deployment=deployment, kind='error', to=admincontactemail(deployment))
+
+@traced('scopuscheck.check_deployment')
+def check_deployment(deployment):
+    """
+    Check whether deployment's authentication tokens are valid and also whether 
+    they're due to expire, sending notifications according to notification state
+    """
+
+    prefix = "[" + label(deployment) + "] " if deployment is not None else ""
+    tokenfailurelockfile = os.path.join(xriskdir(deployment), TOKENFAILURELOCKFILE)
+
+    notifier = notifications(deployment)
+    newtokenchecker = tokenchecker(deployment)
+    tokencheckerresults = newtokenchecker.run()
+    event('check.result', deployment=deployment, success=tokencheckerresults['SUCCESS'], \
+          data=tokencheckerresults['DATA'], expirydate=newtokenchecker.expirydate)
+
+    if tokencheckerresults['SUCCESS']:
+        # If TOKENFAILURELOCKFILE exists remove it
+        if os.path.isfile(tokenfailurelockfile) is True: os.remove(tokenfailurelockfile)
+        print(prefix + "SUCCESS: Valid authentication tokens downloaded test abstract: " + tokencheckerresults['DATA'])
+
+        # Reminders start at first (largest) stage of REMINDERSCHEDULE
+        stage = notifier.expirystage(newtokenchecker.expirydate)
+        if stage is not None:
+            # Only send reminder when next stage of REMINDERSCHEDULE reached
+            if notifier.shouldnotify(CONDITIONEXPIRING, newtokenchecker.expirydate, stage):
+                print(prefix + "WARNING: Sending notification as tokens due to expire on " + newtokenchecker.expirydate + " - " + \
+                      ("expired" if stage == STAGEDAILY else "within " + str(stage) + " days of now"))
+                send_scopus_reminder_message_to_admin(newtokenchecker.expirydate, notifier.digest(), deployment)
+                notifier.notified(CONDITIONEXPIRING, newtokenchecker.expirydate, stage)
+            else:
+                print(prefix + "WARNING: Tokens due to expire on " + newtokenchecker.expirydate + " - no reminder due at this stage of reminder schedule")
+                event('email.suppressed', deployment=deployment, kind='reminder', stage=stage)
+        else:
+            notifier.shouldnotify(CONDITIONOK, '')
+
+    else:
+        # Create TOKENFAILURELOCKFILE as flag to prevent normal crontab tasks from running
+        f = open(tokenfailurelockfile, 'w')
+        f.close()
+
+        # Only send error message when error changes or daily reminder due
+        if notifier.shouldnotify(CONDITIONFAILED, tokencheckerresults['DATA']):
+            print(prefix + "FAILURE: Sending notification as token checker error: " + tokencheckerresults['DATA'])
+            send_error_message_to_admin(tokencheckerresults['OBJ'], tokencheckerresults['DATA'], notifier.digest())
+            notifier.notified(CONDITIONFAILED, tokencheckerresults['DATA'])
+        else:
+            print(prefix + "FAILURE: Token checker error: " + tokencheckerresults['DATA'] + " - notification already sent within last day")
+            event('email.suppressed', deployment=deployment, kind='error')
 
 
 # ***************************************************
@@ -218,26 +276,15 @@ X-Risk/TERRA Sysadmin System
 # ***************************************************
 # *** Checks whether current authentication tokens **
 # **** are valid and also whether they're due to ****
-# ******** expire within EXPIRYREMINDERWINDOW *******
+# ********* reach stage of REMINDERSCHEDULE *********
+# ********* for every registered deployment *********
 # ***************************************************
 
-tokenchecker = tokenchecker()
-tokencheckerresults = tokenchecker.run()
-
-if tokencheckerresults['SUCCESS']:
-    # If TOKENFAILURELOCKFILE exists remove it
-    if os.path.isfile(TOKENFAILURELOCKFILE) is True: os.remove(TOKENFAILURELOCKFILE)
-    print("SUCCESS: Valid authentication tokens downloaded test abstract: " + tokencheckerresults['DATA'])
-
-    if (tokenchecker.expiressoon()):
-        print("WARNING: Sending notification as tokens due to expire on " + tokenchecker.expirydate + " - within " + str(EXPIRYREMINDERWINDOW) + " days of now")
-        send_scopus_reminder_message_to_admin(tokenchecker.expirydate)
-
-else:
-    # Create TOKENFAILURELOCKFILE as flag to prevent normal crontab tasks from running
-    f = open(TOKENFAILURELOCKFILE, 'w')
-    f.close()
-
-    print("FAILURE: Sending notification as token checker error: " + tokencheckerresults['DATA'])
-    send_error_message_to_admin(tokencheckerresults['OBJ'], tokencheckerresults['DATA'])
+# Check all registered deployments concurrently
+with span('scopuscheck'):
+    results = checkall(check_deployment)
 
+for deployment, error in results:
+    if isinstance(error, Exception):
+        print("[" + label(deployment) + "] ERROR: Unable to check authentication tokens: " + repr(error))
+        event('check.error', deployment=deployment, error=repr(error))
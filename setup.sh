@@ -147,17 +147,27 @@ echo "
 sudo chown ${wwwuser}:${wwwuser} ../x-risk/config.json
 sudo chown ${wwwuser}:${wwwuser} scopusauthtokens/passcode/
 sudo chown ${wwwuser}:${wwwuser} scopusauthtokens/tokenchecker/
+sudo chown ${wwwuser}:${wwwuser} scopusauthtokens/notifications/
+sudo chown ${wwwuser}:${wwwuser} scopusauthtokens/tracing/
+sudo chown ${wwwuser}:${wwwuser} scopusauthtokens/events/
+sudo chown ${wwwuser}:${wwwuser} scopusauthtokens/jobs/
 
 # Create link to X-Risk's 'static' folder
 ln -s ../x-risk/static static
 
+# Build fingerprinted and precompressed copies of static CSS/JS files
+echo "Building fingerprinted static assets"
+python3 buildassets.py
+
 # Outputting sysadmin.wsgi
 echo "Creating sysadmin.wsgi"
 echo "import logging
 import sys
 logging.basicConfig(stream=sys.stderr)
 sys.path.insert(0, '$PWD')
-from sysadmin import app as application" > sysadmin.wsgi
+from sysadmin import app as application
+from warmup import warmup
+warmup()" > sysadmin.wsgi
 
 echo "Adding SECRET_KEY to sysadmin.wsgi"
 python3 addsecretkey.py
@@ -14,15 +14,23 @@ import smtplib
 import time
 import pwd
 import grp
-from flask import Flask, render_template, request, redirect
+import mimetypes
+import hashlib
+import json
+from flask import Flask, render_template, request, redirect, make_response, send_from_directory, abort, g, jsonify
 from markupsafe import Markup
 from datetime import datetime
-from email import encoders
-from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from scopusauthtokens.passcode import passcode, PASSCODEEXPIRYTIME, PASSCODETIMEDELAYS
-from scopusauthtokens.tokenchecker import tokenchecker, EXPIRYREMINDERWINDOW
+from scopusauthtokens.tokenchecker import tokenchecker, statusversion
+from scopusauthtokens.notifications import expirystage
+from scopusauthtokens.deployments import deploymentnames, isdeployment, label, admincontactemail, adminurl
+from scopusauthtokens.tracing import span
+from scopusauthtokens.events import event
+from scopusauthtokens.instructions import instructionsattachment
+from scopusauthtokens.jobs import submit, jobid, jobstatus, isjobid, STATEFAILED, ERRORLINKUSED, STAGEVALIDATING, STAGESAVING, STAGERESETTING
+from buildassets import ASSETSDIR, ASSETSMANIFEST as MANIFESTFILE, loadmanifest
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),os.path.pardir))
 xrisk_dir = os.path.abspath(os.path.join(parent_dir, 'x-risk'))
@@ -35,80 +43,335 @@ import config
 app = Flask(__name__)
 application = app # For beanstalk
 
-@app.route('/')
-def home():
+# Fingerprinted assets built by buildassets.py - empty if assets not built
+# Loaded once so Apache must be reloaded after running buildassets.py
+ASSETSMANIFEST = loadmanifest()
+
+def pageversion():
+    """
+    Get hash of asset manifest and templates and time either was last modified
+
+    Included in status page ETag/Last-Modified so cached pages are replaced once
+    reloaded processes render them with new assets or templates
+    """
+
+    digest = hashlib.sha1(json.dumps(ASSETSMANIFEST, sort_keys=True).encode('utf-8'))
+    lastmodified = os.stat(MANIFESTFILE).st_mtime if os.path.isfile(MANIFESTFILE) else 0
+    templatesdir = os.path.join(app.root_path, app.template_folder)
+    for name in sorted(os.listdir(templatesdir)):
+        with open(os.path.join(templatesdir, name), 'rb') as f:
+            digest.update(name.encode('utf-8') + b':' + f.read())
+        lastmodified = max(lastmodified, os.stat(os.path.join(templatesdir, name)).st_mtime)
+
+    return digest.hexdigest()[:20], int(lastmodified)
+
+# Version of assets and templates used by this process when rendering pages
+PAGEVERSION, PAGELASTMODIFIED = pageversion()
+
+# Cache lifetime of fingerprinted assets in seconds - filenames change whenever content changes
+ASSETSMAXAGE = 365 * 24 * 60 * 60
+
+# Most recently rendered status pages as (version, page) keyed on deployment
+STATUSPAGECACHE = {}
+
+# Cache key of fleet status dashboard within STATUSPAGECACHE
+FLEETCACHEKEY = '/fleet'
+
+# Inline SVG versions of Material Icons to avoid loading icon font from Google
+ICONPATHS = {
+    'check_circle': 'M12 2C6.48 2 2 6.48 2 12s4.48 10 10 10 10-4.48 10-10S17.52 2 12 2zm-2 15l-5-5 1.41-1.41L10 14.17l7.59-7.59L19 8l-9 9z',
+    'cancel': 'M12 2C6.47 2 2 6.47 2 12s4.47 10 10 10 10-4.47 10-10S17.53 2 12 2zm5 13.59L15.59 17 12 13.41 8.41 17 7 15.59 10.59 12 7 8.41 8.41 7 12 10.59 15.59 7 17 8.41 13.41 12 17 15.59z',
+    'warning': 'M1 21h22L12 2 1 21zm12-3h-2v-2h2v2zm0-4h-2v-4h2v4z',
+    'schedule': 'M11.99 2C6.47 2 2 6.48 2 12s4.47 10 10 10c5.52 0 10-4.48 10-10S17.52 2 11.99 2zM12 20c-4.42 0-8-3.58-8-8s3.58-8 8-8 8 3.58 8 8-3.58 8-8 8zm.5-13H11v6l5.25 3.15.75-1.23-4.5-2.67z',
+}
+
+def icon(name, colour, size=48):
+    """
+    Create inline SVG icon in supplied colour
+    """
+
+    return '<svg width="' + str(size) + '" height="' + str(size) + '" viewBox="0 0 24 24" style="margin-bottom:5px;vertical-align:middle;" aria-hidden="true">' + \
+           '<path fill="' + colour + '" d="' + ICONPATHS[name] + '"/></svg>'
+
+def asseturl(path):
+    """
+    Get URL of fingerprinted asset, falling back to X-Risk's static folder if assets not built
+    """
+
+    if path in ASSETSMANIFEST:
+        return adminconfig.ADMINURL + '/assets/' + ASSETSMANIFEST[path]
+    return '/static/' + path
+
+@app.context_processor
+def assetprocessor():
+    """
+    Make asset() available to all templates
+    """
+
+    return dict(asset=asseturl)
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    """
+    Serve fingerprinted asset, using precompressed version if browser accepts it
+    """
+
+    if filename not in ASSETSMANIFEST.values():
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    contentencoding = None
+    for encoding, extension in (('br', '.br'), ('gzip', '.gz')):
+        if (request.accept_encodings[encoding] > 0) and os.path.isfile(os.path.join(ASSETSDIR, filename + extension)):
+            contentencoding = encoding
+            filename += extension
+            break
+
+    response = send_from_directory(ASSETSDIR, filename, mimetype=mimetype)
+    if contentencoding:
+        response.headers['Content-Encoding'] = contentencoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=' + str(ASSETSMAXAGE) + ', immutable'
+    return response
+
+@app.before_request
+def startrequestspan():
     """
-    Default page showing current status of authentication tokens
+    Start root span for request named using route rather than URL so passcodes aren't recorded
     """
 
-    newtokenchecker = tokenchecker()
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.requestspan = span(request.method + ' ' + rule).start()
+    if request.view_args and request.view_args.get('deployment'):
+        g.requestspan.tag('deployment', request.view_args['deployment'])
+
+@app.after_request
+def tagrequestspan(response):
+    """
+    Record response status against request span
+    """
+
+    if 'requestspan' in g: g.requestspan.tag('http.status_code', response.status_code)
+    return response
+
+@app.teardown_request
+def finishrequestspan(error=None):
+    """
+    Finish request span once response sent
+    """
+
+    if 'requestspan' in g: g.requestspan.finish(error)
+
+def checkdeployment(deployment):
+    """
+    Return '404 Not Found' if deployment isn't registered
+    """
+
+    if isdeployment(deployment) is False:
+        abort(404)
+
+def cachedbody(cachekey, version, render):
+    """
+    Get page rendered by render() which is cached under cachekey until version changes
+    """
+
+    cached = STATUSPAGECACHE.get(cachekey)
+    if (cached is None) or (cached[0] != version):
+        cached = (version, render())
+        STATUSPAGECACHE[cachekey] = cached
+    return cached[1]
+
+def cachedpage(cachekey, version, lastmodified, render):
+    """
+    Get page rendered by render() which is cached under cachekey until version changes
+
+    Page is sent with ETag/Last-Modified headers so browsers and monitors polling 
+    the page receive '304 Not Modified' if version hasn't changed
+    """
+
+    response = make_response(cachedbody(cachekey, version, render))
+    response.set_etag(version + '-' + PAGEVERSION)
+    response.last_modified = max(lastmodified, PAGELASTMODIFIED)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/', defaults={'deployment': None})
+@app.route('/deployments/<deployment>')
+def home(deployment):
+    """
+    Default page showing current status of deployment's authentication tokens
+
+    Rendered page is cached until token status changes
+    """
+
+    checkdeployment(deployment)
+    try:
+        version, lastmodified = statusversion(deployment)
+        return cachedpage(deployment, version, lastmodified, lambda: renderstatus(deployment))
+    except (OSError, ValueError, KeyError) as e:
+        return renderunreadable(deployment, e)
+
+@app.route('/fleet')
+def fleet():
+    """
+    Dashboard showing current status of authentication tokens for all deployments
+
+    Rendered dashboard is cached until token status of any deployment changes
+    """
+
+    version, lastmodified = fleetversion()
+    return cachedpage(FLEETCACHEKEY, version, lastmodified, renderfleet)
+
+def fleetversion():
+    """
+    Get combined version of all deployments' token status and time any was last modified
+    """
+
+    versions = []
+    lastmodified = 0
+    for deployment in deploymentnames():
+        try:
+            deploymentversion, deploymentlastmodified = statusversion(deployment)
+        except (OSError, ValueError, KeyError):
+            deploymentversion, deploymentlastmodified = 'unavailable', 0
+        versions.append(deploymentversion)
+        lastmodified = max(lastmodified, deploymentlastmodified)
+    version = hashlib.sha1(':'.join(versions).encode('utf-8')).hexdigest()[:20]
+
+    return version, lastmodified
+
+def renderfleet():
+    """
+    Render current status of authentication tokens for all deployments
+    """
+
+    deployments = []
+    for deployment in deploymentnames():
+        row = {'label': label(deployment), 'url': adminurl(deployment), 'expirydate': '', 'lastupdated': ''}
+        try:
+            newtokenchecker = tokenchecker(deployment)
+            tokencheckerresults = newtokenchecker.cachedstatus()
+            row['expirydate'] = datetime.strptime(newtokenchecker.expirydate, '%Y-%m-%d').strftime("%d/%m/%Y")
+            row['lastupdated'] = tokencheckerresults['LASTSAVED'][:16]
+            if tokencheckerresults['SUCCESS'] is False:
+                row['icon'], row['status'] = icon('cancel', '#f44336', 24), "Not working"
+            elif expirystage(newtokenchecker.expirydate) is not None:
+                row['icon'], row['status'] = icon('warning', '#fb8c00', 24), "Due to expire"
+            else:
+                row['icon'], row['status'] = icon('check_circle', '#4caf50', 24), "Working correctly"
+        except (OSError, ValueError, KeyError) as e:
+            # Details may include server paths so are only written to event log
+            event('status.unreadable', deployment=deployment, error=repr(e))
+            row['icon'], row['status'] = icon('cancel', '#f44336', 24), "Unable to read status"
+        row['icon'] = Markup(row['icon'])
+        deployments.append(row)
+
+    return render_template("fleet.html", \
+        baseurl=adminconfig.ADMINURL, \
+        title="Fleet Status", \
+        deployments=deployments )
+
+def renderunreadable(deployment, error):
+    """
+    Render page explaining deployment's token status can't be read, eg. because its config.json is missing
+    Details of error may include server paths so are only written to event log
+    """
+
+    event('status.unreadable', deployment=deployment, error=repr(error))
+
+    title = "X-Risk Status"
+    if deployment is not None: title += ": " + label(deployment)
+
+    response = make_response(render_template("index.html", \
+        showemailform=False, \
+        baseurl=adminurl(deployment), \
+        title=title, \
+        errormessage=Markup("<span class=\"text-danger\"><b>Unable to read status of authentication tokens</b></span>"), \
+        icon=Markup(icon('cancel', '#f44336')), \
+        status=Markup("<p>Please check " + label(deployment) + " is installed correctly.</p>") ), 503)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def renderstatus(deployment=None):
+    """
+    Render current status of deployment's authentication tokens
+    """
+
+    newtokenchecker = tokenchecker(deployment)
     tokencheckerresults = newtokenchecker.cachedstatus()
     expirydate = datetime.strptime(newtokenchecker.expirydate, '%Y-%m-%d').strftime("%d/%m/%Y")
 
     showemailform = False
-    icon = '<i class="material-icons text-success mdi-48px" style="padding-bottom:5px;">check_circle</i>'
+    statusicon = icon('check_circle', '#4caf50')
     errormessage = "<span class=\"text-success\"><b>Authentication tokens working correctly</b></span>"
     status = "<p>They are due to expire on <b>" + expirydate + "</b>.</p>"
     
     if tokencheckerresults['SUCCESS'] is False:
         showemailform = True
-        icon = '<i class="material-icons text-danger mdi-48px" style="padding-bottom:5px;">cancel</i>'
+        statusicon = icon('cancel', '#f44336')
         errormessage = "<span class=\"text-danger\"><b>Authentication tokens not working</b></span>"
         status = """
         <p> 
-        This will cause problems with the running of the X-Risk/TERRA website and 
+        This will cause problems with the running of the """ + label(deployment) + """ website and 
         new authentication tokens need to be obtained <b>urgently</b>.
         </p>
         <p>
         To receive an email providing instructions on how to obtain new authentication tokens from Elsevier, 
-        enter the registered admin email address for X-Risk/TERRA below. 
+        enter the registered admin email address for """ + label(deployment) + """ below. 
         </p>
         """
     else:
-        if newtokenchecker.expiressoon():
+        # Warning shown from first stage of reminder schedule, matching reminder emails
+        if expirystage(newtokenchecker.expirydate) is not None:
             showemailform = True
-            icon = '<i class="material-icons mdi-48px" style="padding-bottom:5px;color:#fb8c00">warning</i>'
+            statusicon = icon('warning', '#fb8c00')
             errormessage = "<span style='color:#fb8c00'><b>Authentication tokens due to expire on " + expirydate + "</b></span>"
             status = """
             <p>New authentication tokens need to be obtained as soon as possible from Elsevier 
-            to prevent loss of service to X-Risk/TERRA. If you've received an email notifying you that 
+            to prevent loss of service to """ + label(deployment) + """. If you've received an email notifying you that 
             authentication tokens are due to expiry soon, please follow the instructions in the email.
             </p>
             <p>
             To receive an email providing instructions on how to obtain new authentication tokens 
-            from Elsevier, enter the registered admin email address for X-Risk/TERRA below. 
+            from Elsevier, enter the registered admin email address for """ + label(deployment) + """ below. 
             </p>
             """
 
     status += "<p><i>Last updated: " + tokencheckerresults['LASTSAVED'][:16] + "</i></b>"
 
+    title = "X-Risk Status"
+    if deployment is not None: title += ": " + label(deployment)
+
     return render_template("index.html", \
         showemailform=showemailform, \
-        baseurl=adminconfig.ADMINURL, \
-        title="X-Risk Status", \
+        baseurl=adminurl(deployment), \
+        title=title, \
         errormessage=Markup(errormessage), \
-        icon=Markup(icon), \
+        icon=Markup(statusicon), \
         status=Markup(status) )
 
-@app.route('/resendpasscode', methods=["GET", "POST"])
-def resendpasscode():
+@app.route('/resendpasscode', methods=["GET", "POST"], defaults={'deployment': None})
+@app.route('/deployments/<deployment>/resendpasscode', methods=["GET", "POST"])
+def resendpasscode(deployment):
     """
-    If supplied admin email matches stored admin email, send token resetting link
+    If supplied admin email matches deployment's stored admin email, send token resetting link
     """
 
+    checkdeployment(deployment)
     adminemail = request.form["adminemail"].strip()
-    if adminemail.lower() == adminconfig.ADMINCONTACTEMAIL.lower():
+    if adminemail.lower() == admincontactemail(deployment).lower():
 
     # Create message container - the correct MIME type is multipart/alternative.
         msg = MIMEMultipart('alternative')
         msg['Subject'] = "Reset Elsevier Scopus authentication tokens"
+        if deployment is not None: msg['Subject'] += " for " + label(deployment)
         msg['From'] = config.EMAIL_HOST_USER
-        msg['To'] = adminconfig.ADMINCONTACTEMAIL
+        msg['To'] = admincontactemail(deployment)
 
         # Create new passcode with expiry to easily allow admin user to change tokens
-        latestpasscode = passcode()
-        newpasscode = latestpasscode.create()
-        entertokensurl = adminconfig.ADMINURL + '/' + newpasscode
+        # Link is explicitly requested so always gets full PASSCODEEXPIRYTIME rather than reusing current passcode
+        latestpasscode = passcode(deployment)
+        entertokensurl = latestpasscode.getresetlink(adminurl(deployment))
 
         # Create the body of the message (a plain-text and an HTML version).
         text = """Dear CSER Admin,
@@ -153,45 +416,39 @@ X-Risk/TERRA Sysadmin System
         msg.attach(part2)
 
         # Add 'Instructions.pdf' attachment to email
-        filename = "Instructions.pdf"  
-
-        with open(filename, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment.read())
+        msg.attach(instructionsattachment())
 
-        encoders.encode_base64(part)
-        part.add_header(
-            "Content-Disposition",
-            f"attachment; filename= {filename}",
-        )
-
-        msg.attach(part)
-
-        with smtplib.SMTP(config.EMAIL_HOST, config.EMAIL_PORT) as server:
+        with span('smtp.send'), smtplib.SMTP(config.EMAIL_HOST, config.EMAIL_PORT) as server:
             server.ehlo()
             server.starttls()    
             server.login(config.EMAIL_HOST_USER, config.EMAIL_HOST_PASSWORD)
-            server.sendmail(config.EMAIL_HOST_USER, adminconfig.ADMINCONTACTEMAIL, msg.as_string())
+            server.sendmail(config.EMAIL_HOST_USER, admincontactemail(deployment), msg.as_string())
+        event('email.sent', deployment=deployment, kind='resetlink', to=admincontactemail(deployment))
+
+    else:
+        event('email.refused', deployment=deployment, kind='resetlink')
 
-    return render_template("passcodesent.html", baseurl=adminconfig.ADMINURL, title="Link sent")
+    return render_template("passcodesent.html", baseurl=adminurl(deployment), title="Link sent")
 
-@app.route('/<userpasscode>')
-def inittokenupdate(userpasscode):
+@app.route('/<userpasscode>', defaults={'deployment': None})
+@app.route('/deployments/<deployment>/<userpasscode>')
+def inittokenupdate(userpasscode, deployment):
     """
     Initialize token update procedure using user-supplied passcode 
     User-supplied passcode will have been sent via email on token failure / annual schedule   
     """
 
-    latestpasscode = passcode()   
+    checkdeployment(deployment)
+    latestpasscode = passcode(deployment)   
     if latestpasscode.isvalid(userpasscode):
         if latestpasscode.isexpired():
-            return passcodeexpired()
+            return passcodeexpired(deployment)
         else:
-            return passcodevalid(userpasscode)
+            return passcodevalid(userpasscode, deployment)
     else:
-        return passcodeincorrect()
+        return passcodeincorrect(deployment)
 
-def passcodeexpired():
+def passcodeexpired(deployment=None):
     """
     Inform user that link has expired and give them option to be sent another link
     """
@@ -199,24 +456,24 @@ def passcodeexpired():
     status = """
     Reset authentication tokens link must be used within """ + str(PASSCODEEXPIRYTIME) + """ 
     minutes of being sent. To be sent another link, enter the registered admin email address 
-    for X-Risk/TERRA below:
+    for """ + label(deployment) + """ below:
     """
     return render_template("index.html", \
         showemailform=True, \
-        baseurl=adminconfig.ADMINURL, \
+        baseurl=adminurl(deployment), \
         title="Link expired", 
         status=status )
   
-def passcodevalid(userpasscode):
+def passcodevalid(userpasscode, deployment=None):
     """
     If passcode valid, present form for entering new authentication tokens 
     """    
     return render_template("entertokens.html", \
-        baseurl=adminconfig.ADMINURL, \
+        baseurl=adminurl(deployment), \
         title="Enter authentication tokens", 
         userpasscode=userpasscode )
 
-def passcodeincorrect():
+def passcodeincorrect(deployment=None):
     """
     If passcode incorrect, give user option to be sent another link  
     but include delay to prevent brute force attack
@@ -228,45 +485,121 @@ def passcodeincorrect():
     status = """
     Your tokens reset link does not appear to be valid. 
     It may have been reset following a successful attempt to update the tokens. 
-    To be sent another link, enter the registered admin email address for X-Risk/TERRA below:
+    To be sent another link, enter the registered admin email address for """ + label(deployment) + """ below:
     """
     return render_template("index.html", \
         showemailform=True, \
-        baseurl=adminconfig.ADMINURL, \
+        baseurl=adminurl(deployment), \
         title="Invalid link", \
         status=status )
     
-@app.route('/updatetokens/<userpasscode>/', methods=["POST"])
-def updatetokens(userpasscode):
+@app.route('/updatetokens/<userpasscode>/', methods=["POST"], defaults={'deployment': None})
+@app.route('/deployments/<deployment>/updatetokens/<userpasscode>/', methods=["POST"])
+def updatetokens(userpasscode, deployment):
     """
-    Process supplied authentication tokens
-    If valid tokens, update system with new tokens
+    Submit supplied authentication tokens as background job and redirect to job's progress page
+    Job validates tokens with Elsevier then, if valid, saves tokens and resets passcode
+
+    Resubmitting same tokens returns existing job so tokens are never saved twice
     """
 
-    latestpasscode = passcode()
-    if latestpasscode.isvalid(userpasscode):
+    checkdeployment(deployment)
+    apikey = request.form["apikey"].strip()
+    insttoken = request.form["insttoken"].strip()
+    expirydate = request.form["expirydate"]
+
+    existingjob = jobstatus(jobid(deployment, userpasscode, apikey, insttoken, expirydate))
+    if (existingjob is None) or (existingjob['state'] == STATEFAILED):
+        latestpasscode = passcode(deployment)
+        if latestpasscode.isvalid(userpasscode) is False:
+            return passcodeincorrect(deployment)
+
+    id = submit(deployment, userpasscode, apikey, insttoken, expirydate)[0]
+    return redirect(adminurl(deployment) + '/jobs/' + id, code=303)
+
+def checkjob(id, deployment):
+    """
+    Get status of deployment's job, returning 404 page if job doesn't exist
+    """
+
+    status = jobstatus(id) if isjobid(id) else None
+    if (status is None) or (status['deployment'] != deployment):
+        abort(404)
+    return status
+
+@app.route('/jobs/<id>/status', defaults={'deployment': None})
+@app.route('/deployments/<deployment>/jobs/<id>/status')
+def jobstatusjson(id, deployment):
+    """
+    Progress and verdict of token update job as JSON for polling
+    """
+
+    checkdeployment(deployment)
+    response = jsonify(checkjob(id, deployment))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Labels and icons of token update job stages shown on progress page
+JOBSTAGELABELS = {
+    STAGEVALIDATING: "Checking authentication tokens with Elsevier",
+    STAGESAVING: "Saving authentication tokens",
+    STAGERESETTING: "Resetting reset link",
+}
 
-        # If passcode is valid, check supplied token values with Elsevier
-        newtokenchecker = tokenchecker()
-        apikey = request.form["apikey"].strip()
-        insttoken = request.form["insttoken"].strip()
-        newtokenchecker.settokens(apikey, insttoken)
-        tokencheckerresults = newtokenchecker.run()
-
-        if tokencheckerresults['SUCCESS']:
-            # If supplied tokens are valid, save tokens and reset passcode as no longer required
-            expirydate = request.form["expirydate"]
-            newtokenchecker.savetokens(apikey, insttoken, expirydate)
-            latestpasscode.reset()
-            return redirect(adminconfig.ADMINURL)
+# Seconds between refreshes of progress page while job is running
+JOBPAGEREFRESH = 2
+
+@app.route('/jobs/<id>', defaults={'deployment': None})
+@app.route('/deployments/<deployment>/jobs/<id>')
+def jobpage(id, deployment):
+    """
+    Page showing progress of token update job, refreshing until job finishes, then its verdict
+    """
+
+    checkdeployment(deployment)
+    status = checkjob(id, deployment)
+
+    stages = []
+    for stage in status['stages']:
+        if stage['finished'] is not None:
+            stageicon, progress = icon('check_circle', '#4caf50', 24), "Done"
+        elif (stage['name'] == status['state']) and (status['finished'] is False):
+            stageicon, progress = icon('schedule', '#fb8c00', 24), "In progress"
+        elif (stage['started'] is not None) and (status['state'] == STATEFAILED):
+            stageicon, progress = icon('cancel', '#f44336', 24), "Failed"
+        else:
+            stageicon, progress = icon('schedule', '#9e9e9e', 24), "Waiting"
+        stages.append({'icon': Markup(stageicon), 'label': JOBSTAGELABELS[stage['name']], 'progress': progress})
+
+    preciseerror, verdict = '', ''
+    if status['success']:
+        title, statusicon, errormessage = "Tokens updated", icon('check_circle', '#4caf50'), \
+            "<span class=\"text-success\"><b>Authentication tokens updated</b></span>"
+        verdict = "<p><a href=\"" + adminurl(deployment) + "\">View status of authentication tokens</a></p>"
+    elif status['finished']:
+        title, statusicon, errormessage = "Tokens error", icon('cancel', '#f44336'), \
+            "<span class=\"text-danger\"><b>" + str(Markup.escape(status['error'])) + "</b></span>"
+        if status['detail']:
+            preciseerror = "<p>Precise error: <code>" + str(Markup.escape(status['detail'])) + "</code></p>"
+        if status['error'] == ERRORLINKUSED:
+            # Reset link no longer valid so can't be used to try again
+            verdict = "<p>The authentication tokens may already have been updated. Check the <a href=\"" + adminurl(deployment) + \
+                "\">status of authentication tokens</a> and, if new tokens are still needed, request a new reset link there.</p>"
         else:
-            # If supplied tokens invalid, allow user to enter different authentication tokens
-            return render_template("entertokens.html", \
-                baseurl=adminconfig.ADMINURL, \
-                title="Tokens error", \
-                preciseerror=Markup("<p>Precise error: <code>" + tokencheckerresults['DATA'] + "</code></p>"), \
-                errormessage="Authentication tokens not valid", \
-                userpasscode=userpasscode, \
-                body="Please reenter different authentication tokens below:" )
+            verdict = "<p>To enter different authentication tokens, use the reset link sent to you by email again.</p>"
     else:
-        return passcodeincorrect()
+        title, statusicon, errormessage = "Updating tokens", icon('schedule', '#fb8c00'), \
+            "<span><b>Updating authentication tokens for " + label(deployment) + "</b></span>"
+        verdict = "<p>This page will update automatically.</p>"
+
+    response = make_response(render_template("jobstatus.html", \
+        baseurl=adminurl(deployment), \
+        title=title, \
+        icon=Markup(statusicon), \
+        errormessage=Markup(errormessage), \
+        preciseerror=Markup(preciseerror), \
+        stages=stages, \
+        verdict=Markup(verdict), \
+        refresh=None if status['finished'] else JOBPAGEREFRESH ))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
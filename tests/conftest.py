@@ -0,0 +1,54 @@
+"""
+Shared fixtures for tests of notification and token update job state
+
+adminconfig.py is created by setup.sh so tests use their own settings, and every state
+file is redirected to a temporary folder so tests never touch real state files
+"""
+
+import os
+import sys
+import pwd
+import types
+import importlib
+import pytest
+
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOTDIR)
+
+# State files are created owned by WWW_USER so use current user
+adminconfig = types.ModuleType('adminconfig')
+adminconfig.WWW_USER = pwd.getpwuid(os.getuid()).pw_name
+adminconfig.ADMINURL = 'https://yourdomain.com/sysadmin'
+adminconfig.ADMINCONTACTEMAIL = 'admin@yourdomain.com'
+sys.modules['adminconfig'] = adminconfig
+
+from scopusauthtokens.logfiles import rotatingfile
+from scopusauthtokens.events import EVENTWRITER
+
+passcodemodule = importlib.import_module('scopusauthtokens.passcode')
+tokencheckermodule = importlib.import_module('scopusauthtokens.tokenchecker')
+notificationsmodule = importlib.import_module('scopusauthtokens.notifications')
+jobsmodule = importlib.import_module('scopusauthtokens.jobs')
+
+
+@pytest.fixture(autouse=True)
+def statedir(tmp_path, monkeypatch):
+    """
+    Redirect all state files, X-Risk config file and event log to temporary folder
+    """
+
+    for folder in ['passcode', 'tokenchecker', 'notifications', 'jobs', 'events', 'x-risk']:
+        (tmp_path / folder).mkdir()
+
+    configfile = tmp_path / 'x-risk' / 'config.json'
+    configfile.write_text('{"apikey": "oldkey", "insttoken": "oldtoken", "expirydate": "2027-01-01"}')
+
+    monkeypatch.setattr(passcodemodule, 'PASSCODEFILE', str(tmp_path / 'passcode' / 'passcode.json'))
+    monkeypatch.setattr(tokencheckermodule, 'TOKENCHECKERFILE', str(tmp_path / 'tokenchecker' / 'tokenchecker.json'))
+    monkeypatch.setattr(tokencheckermodule, 'CONFIGFILE', str(configfile))
+    monkeypatch.setattr(notificationsmodule, 'NOTIFICATIONSFILE', str(tmp_path / 'notifications' / 'notifications.json'))
+    monkeypatch.setattr(jobsmodule, 'JOBSDIR', str(tmp_path / 'jobs'))
+    monkeypatch.setattr(jobsmodule, 'JOBSLOCKFILE', str(tmp_path / 'jobs' / 'jobs.lock'))
+    monkeypatch.setattr(EVENTWRITER, 'file', rotatingfile(str(tmp_path / 'events' / 'events.jsonl'), 1024 * 1024, 1))
+
+    return tmp_path
@@ -0,0 +1,174 @@
+"""
+Tests of token update jobs - duplicate submits, resuming failed jobs and jobs racing on one passcode
+
+Elsevier is replaced by fakeelsevier so tests control result and timing of each validation
+"""
+
+import os
+import json
+import stat
+import time
+import threading
+import pytest
+from scopusauthtokens import jobs
+from scopusauthtokens.jobs import submit, jobstatus, jobfile, STATEDONE, STATEFAILED
+from scopusauthtokens.passcode import passcode
+from conftest import tokencheckermodule
+
+# Maximum time in seconds to wait for job to finish
+JOBTIMEOUT = 5
+
+
+class fakeelsevier():
+    """
+    Replaces tokenchecker.run() and savetokens(), recording validations and saves
+    """
+
+    def __init__(self):
+        self.validtokens = set()
+        self.validated = []
+        self.saved = []
+        self.gates = {}
+        self.lock = threading.Lock()
+
+    def run(self, checker):
+        with self.lock:
+            self.validated.append(checker.apikey)
+            gate = self.gates.get(checker.apikey)
+        if gate is not None: gate()
+        if checker.apikey in self.validtokens:
+            return {'SUCCESS': True, 'OBJ': checker, 'DATA': "Valid"}
+        return {'SUCCESS': False, 'OBJ': checker, 'DATA': "Invalid API key"}
+
+    def savetokens(self, checker, apikey, insttoken, expirydate):
+        with self.lock:
+            self.saved.append((apikey, insttoken, expirydate))
+
+@pytest.fixture
+def elsevier(monkeypatch):
+    fake = fakeelsevier()
+    monkeypatch.setattr(tokencheckermodule.tokenchecker, 'run', lambda checker: fake.run(checker))
+    monkeypatch.setattr(tokencheckermodule.tokenchecker, 'savetokens', lambda checker, *args: fake.savetokens(checker, *args))
+    return fake
+
+def waitforjob(id):
+    """
+    Wait for job to finish, returning its status
+    """
+
+    deadline = time.time() + JOBTIMEOUT
+    while time.time() < deadline:
+        status = jobstatus(id)
+        if status['finished'] and not any(t.name == 'tokenupdate-' + id for t in threading.enumerate()):
+            return status
+        time.sleep(0.01)
+    raise AssertionError("Job " + id + " didn't finish")
+
+
+def test_successful_job(elsevier):
+    elsevier.validtokens.add('newkey')
+    userpasscode = passcode().create()
+
+    id, started = submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01')
+    status = waitforjob(id)
+
+    assert started
+    assert status['state'] == STATEDONE and status['success']
+    assert all(stage['finished'] is not None for stage in status['stages'])
+    assert elsevier.saved == [('newkey', 'newtoken', '2028-01-01')]
+    assert passcode().CURRENTPASSCODE == ''
+
+def test_job_file_private_and_without_tokens(elsevier):
+    elsevier.validtokens.add('newkey')
+    id, started = submit(None, passcode().create(), 'newkey', 'newtoken', '2028-01-01')
+    waitforjob(id)
+
+    assert stat.S_IMODE(os.stat(jobfile(id)).st_mode) == 0o600
+    with open(jobfile(id)) as f:
+        job = json.load(f)
+    assert 'APIKEY' not in job and 'INSTTOKEN' not in job
+    assert 'newkey' not in json.dumps(jobstatus(id))
+
+def test_invalid_tokens_fail_without_saving(elsevier):
+    userpasscode = passcode().create()
+    id, started = submit(None, userpasscode, 'badkey', 'badtoken', '2028-01-01')
+    status = waitforjob(id)
+
+    assert status['state'] == STATEFAILED
+    assert status['detail'] == "Invalid API key"
+    assert elsevier.saved == []
+    assert passcode().CURRENTPASSCODE == userpasscode
+    with open(jobfile(id)) as f:
+        assert 'badkey' not in f.read()
+
+def test_duplicate_submits_start_one_job(elsevier):
+    elsevier.validtokens.add('newkey')
+    userpasscode = passcode().create()
+
+    results = []
+    def submitform():
+        results.append(submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01'))
+    threads = [threading.Thread(target=submitform) for i in range(5)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    assert len(set(id for id, started in results)) == 1
+    assert sum(started for id, started in results) == 1
+    waitforjob(results[0][0])
+
+    # Resubmitting finished job returns it without running again
+    assert submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01') == (results[0][0], False)
+    assert elsevier.validated == ['newkey']
+    assert len(elsevier.saved) == 1
+
+def test_failed_job_resumed(elsevier):
+    userpasscode = passcode().create()
+    id, started = submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01')
+    assert waitforjob(id)['state'] == STATEFAILED
+
+    # Eg. Elsevier hadn't yet activated tokens
+    elsevier.validtokens.add('newkey')
+    assert submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01') == (id, True)
+    assert waitforjob(id)['state'] == STATEDONE
+    assert elsevier.saved == [('newkey', 'newtoken', '2028-01-01')]
+
+def test_jobs_racing_on_one_passcode(elsevier):
+    elsevier.validtokens.update(['firstkey', 'secondkey'])
+    userpasscode = passcode().create()
+
+    # Both jobs finish validating before either saves
+    barrier = threading.Barrier(2)
+    elsevier.gates['firstkey'] = elsevier.gates['secondkey'] = lambda: barrier.wait(JOBTIMEOUT)
+
+    firstid, started = submit(None, userpasscode, 'firstkey', 'firsttoken', '2028-01-01')
+    secondid, started = submit(None, userpasscode, 'secondkey', 'secondtoken', '2028-01-01')
+    statuses = [waitforjob(firstid), waitforjob(secondid)]
+
+    assert sorted(status['state'] for status in statuses) == [STATEDONE, STATEFAILED]
+    assert len(elsevier.saved) == 1
+    failed = [status for status in statuses if status['state'] == STATEFAILED][0]
+    assert "already been used" in failed['error']
+
+def test_superseded_attempt_cannot_overwrite_resumed_job(elsevier, monkeypatch):
+    elsevier.validtokens.add('newkey')
+    userpasscode = passcode().create()
+
+    # First attempt hangs in validation until released
+    release = threading.Event()
+    def hangfirst():
+        if elsevier.validated == ['newkey']: release.wait(JOBTIMEOUT)
+    elsevier.gates['newkey'] = hangfirst
+    id, started = submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01')
+    while elsevier.validated == []: time.sleep(0.01)
+
+    # First attempt appears stalled so resubmitting resumes job as second attempt
+    monkeypatch.setattr(jobs, 'JOBSTALLEDTIME', 0)
+    assert submit(None, userpasscode, 'newkey', 'newtoken', '2028-01-01') == (id, True)
+    monkeypatch.setattr(jobs, 'JOBSTALLEDTIME', 10 * 60)
+    while jobstatus(id)['state'] != STATEDONE: time.sleep(0.01)
+
+    # First attempt finishes validating afterwards but mustn't change job
+    release.set()
+    status = waitforjob(id)
+    assert status['state'] == STATEDONE
+    assert len(elsevier.saved) == 1
@@ -0,0 +1,98 @@
+"""
+Tests of notification state - escalation stages, suppression and digest
+"""
+
+import time
+from datetime import date, timedelta
+import pytest
+from scopusauthtokens.notifications import notifications, CONDITIONOK, CONDITIONEXPIRING, CONDITIONFAILED, STAGEDAILY
+from conftest import notificationsmodule
+
+
+def expiringin(days):
+    """
+    Expiry date days from today
+    """
+
+    return (date.today() + timedelta(days=days)).isoformat()
+
+@pytest.fixture(autouse=True)
+def schedule(monkeypatch):
+    """
+    Use default reminder schedule whatever adminconfig.py sets
+    """
+
+    monkeypatch.setattr(notificationsmodule, 'REMINDERSCHEDULE', [30, 14, 7, 3, 1])
+
+
+@pytest.mark.parametrize('days, stage', [(45, None), (30, 30), (20, 30), (14, 14), (8, 14), (7, 7), (2, 3), (1, 1), (0, STAGEDAILY), (-5, STAGEDAILY)])
+def test_expirystage(days, stage):
+    assert notifications().expirystage(expiringin(days)) == stage
+
+def test_expirystage_schedule_beyond_30_days(monkeypatch):
+    monkeypatch.setattr(notificationsmodule, 'REMINDERSCHEDULE', [60, 30, 7])
+    assert notifications().expirystage(expiringin(45)) == 60
+    assert notifications().expirystage(expiringin(61)) is None
+
+def test_expiring_not_notified_before_schedule():
+    assert notifications().shouldnotify(CONDITIONEXPIRING, expiringin(45), None) is False
+
+def test_expiring_notified_once_per_stage():
+    notifier = notifications()
+    expirydate = expiringin(10)
+    assert notifier.shouldnotify(CONDITIONEXPIRING, expirydate, 14)
+    notifier.notified(CONDITIONEXPIRING, expirydate, 14)
+
+    # Same stage on following days is suppressed and listed in digest
+    notifier = notifications()
+    assert notifier.shouldnotify(CONDITIONEXPIRING, expirydate, 14) is False
+    assert notifier.shouldnotify(CONDITIONEXPIRING, expirydate, 14) is False
+    assert "2 further check(s)" in notifications().digest()
+
+    # Next stage sends notification and clears digest
+    notifier = notifications()
+    assert notifier.shouldnotify(CONDITIONEXPIRING, expirydate, 7)
+    notifier.notified(CONDITIONEXPIRING, expirydate, 7)
+    assert notifications().digest() == ''
+
+def test_new_expiry_date_notified():
+    notifier = notifications()
+    notifier.notified(CONDITIONEXPIRING, expiringin(10), 14)
+    assert notifier.shouldnotify(CONDITIONEXPIRING, expiringin(12), 14)
+
+def test_failure_notified_daily_and_when_error_changes():
+    notifier = notifications()
+    assert notifier.shouldnotify(CONDITIONFAILED, "Invalid API key")
+    notifier.notified(CONDITIONFAILED, "Invalid API key")
+
+    assert notifier.shouldnotify(CONDITIONFAILED, "Invalid API key") is False
+    assert notifier.shouldnotify(CONDITIONFAILED, "Quota exceeded")
+
+    # Daily reminder once DAILYREMINDERINTERVAL has passed
+    notifier.LASTSENT = time.time() - notificationsmodule.DAILYREMINDERINTERVAL
+    notifier.update()
+    assert notifications().shouldnotify(CONDITIONFAILED, "Invalid API key")
+
+def test_digest_limited_to_maximum_entries(monkeypatch):
+    monkeypatch.setattr(notificationsmodule, 'MAXDIGESTENTRIES', 3)
+    notifier = notifications()
+    notifier.notified(CONDITIONFAILED, "Invalid API key")
+    for i in range(5):
+        notifier.shouldnotify(CONDITIONFAILED, "Invalid API key")
+    assert len(notifications().SUPPRESSED) == 3
+
+def test_ok_clears_state():
+    notifier = notifications()
+    notifier.notified(CONDITIONFAILED, "Invalid API key")
+    notifier.shouldnotify(CONDITIONFAILED, "Invalid API key")
+
+    assert notifier.shouldnotify(CONDITIONOK, '') is False
+    notifier = notifications()
+    assert (notifier.CONDITION, notifier.STAGE, notifier.SUPPRESSED) == (CONDITIONOK, None, [])
+
+    # Same failure after recovery is notified again
+    assert notifier.shouldnotify(CONDITIONFAILED, "Invalid API key")
+
+def test_deployments_have_separate_state():
+    notifications().notified(CONDITIONFAILED, "Invalid API key")
+    assert notifications('staging').CONDITION == CONDITIONOK
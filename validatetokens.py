@@ -0,0 +1,219 @@
+"""
+Utility script that validates many candidate Elsevier apikey/insttoken pairs against
+Elsevier Scopus concurrently, eg. when Elsevier supply several candidate pairs or
+when auditing old authentication tokens
+
+Reads one credential pair per line from file or stdin, either whitespace/comma-separated
+'APIKEY [INSTTOKEN]' or JSON '{"apikey": "...", "insttoken": "..."}'. Blank lines and
+lines starting with '#' are ignored and lines that can't be parsed are reported as errors.
+Results are written to stdout as JSON lines as soon as each check completes, with apikey and
+insttoken masked. Requests are rate-limited across all workers to avoid Elsevier throttling
+
+python3 validatetokens.py candidates.txt
+cat candidates.txt | python3 validatetokens.py --workers 4 --rate 2
+
+Exits with status 0 if every credential pair is valid, 1 otherwise
+
+Doesn't import Flask or modify any stored tokens or status files
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scopusauthtokens.tokenchecker import tokenchecker
+
+# Default number of credential pairs checked at the same time
+DEFAULTWORKERS = 4
+
+# Default maximum number of requests per second to Elsevier across all workers
+DEFAULTRATE = 2.0
+
+# Number of trailing characters of apikey/insttoken shown in results
+UNMASKEDCHARACTERS = 4
+
+# Number of credential pairs per worker read ahead of checks so large inputs aren't held in memory
+PENDINGPERWORKER = 2
+
+
+class resultwriter():
+    """
+    Class to write results to stdout as each check completes, limiting checks waiting to run
+    """
+
+    def __init__(self, maxpending):
+        """
+        Init writer allowing maxpending checks to be submitted but not yet completed
+        """
+
+        self.pending = threading.BoundedSemaphore(maxpending)
+        self.lock = threading.Lock()
+        self.allvalid = True
+
+    def write(self, result):
+        """
+        Write single result as JSON line
+        """
+
+        with self.lock:
+            self.allvalid = self.allvalid and result['success']
+            print(json.dumps(result), flush=True)
+
+    def submit(self, executor, linenumber, apikey, insttoken, limiter):
+        """
+        Submit check once fewer than maxpending checks are waiting, writing result when it completes
+        """
+
+        self.pending.acquire()
+        future = executor.submit(validate, linenumber, apikey, insttoken, limiter)
+        future.add_done_callback(lambda future: self.completed(linenumber, future))
+
+    def completed(self, linenumber, future):
+        """
+        Write result of completed check and allow next check to be submitted
+        """
+
+        try:
+            result = future.result()
+        except Exception as e:
+            result = parseerror(linenumber, repr(e))
+        try:
+            self.write(result)
+        finally:
+            self.pending.release()
+
+
+class ratelimiter():
+    """
+    Class to limit rate of requests shared across threads
+    """
+
+    def __init__(self, rate):
+        """
+        Init rate limiter allowing rate requests per second
+        """
+
+        self.interval = 1.0 / rate
+        self.nextslot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until next request is allowed
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextslot)
+            self.nextslot = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+
+def positiveint(value):
+    """
+    Parse command-line value as integer greater than zero
+    """
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be a whole number: '" + value + "'")
+    if number <= 0: raise argparse.ArgumentTypeError("must be greater than 0: '" + value + "'")
+    return number
+
+def positivefloat(value):
+    """
+    Parse command-line value as number greater than zero
+    """
+
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be a number: '" + value + "'")
+    if (number > 0) is False: raise argparse.ArgumentTypeError("must be greater than 0: '" + value + "'")
+    return number
+
+def mask(value):
+    """
+    Mask all but last UNMASKEDCHARACTERS of apikey/insttoken so results can be safely logged
+    """
+
+    if value == '': return ''
+    if len(value) <= UNMASKEDCHARACTERS: return '*' * len(value)
+    return '*' * (len(value) - UNMASKEDCHARACTERS) + value[-UNMASKEDCHARACTERS:]
+
+def readcredentials(lines):
+    """
+    Parse credential pairs from lines as they are read, yielding (line number, apikey, insttoken, error)
+    If line can't be parsed, apikey and insttoken are None and error describes problem
+    """
+
+    for linenumber, line in enumerate(lines, 1):
+        line = line.strip()
+        if (line == '') or line.startswith('#'): continue
+
+        if line.startswith('{'):
+            try:
+                credentials = json.loads(line)
+                apikey, insttoken = credentials['apikey'], credentials.get('insttoken', '')
+                if (isinstance(apikey, str) is False) or (isinstance(insttoken, str) is False): raise TypeError
+            except json.JSONDecodeError as e:
+                yield linenumber, None, None, "Invalid JSON: " + e.msg
+            except (KeyError, TypeError, AttributeError):
+                yield linenumber, None, None, "JSON must be an object with 'apikey' and optional 'insttoken' strings"
+            else:
+                yield linenumber, apikey, insttoken, None
+        else:
+            values = line.replace(',', ' ').split()
+            if len(values) > 2:
+                yield linenumber, None, None, "Expected 'APIKEY [INSTTOKEN]' but found " + str(len(values)) + " values"
+            else:
+                yield linenumber, values[0], values[1] if len(values) > 1 else '', None
+
+def parseerror(linenumber, error):
+    """
+    Result for line that couldn't be parsed or checked
+    """
+
+    return {'line': linenumber, 'apikey': None, 'insttoken': None, 'success': False, 'data': error, 'elapsed': 0}
+
+def validate(linenumber, apikey, insttoken, limiter):
+    """
+    Validate single credential pair against Elsevier without saving any results
+    """
+
+    limiter.wait()
+    started = time.perf_counter()
+    newtokenchecker = tokenchecker(loadtokens=False)
+    newtokenchecker.settokens(apikey, insttoken)
+    try:
+        tokencheckerresults = newtokenchecker.run()
+        success, data = tokencheckerresults['SUCCESS'], tokencheckerresults['DATA']
+    except Exception as e:
+        success, data = False, repr(e)
+
+    return {'line': linenumber, 'apikey': mask(apikey), 'insttoken': mask(insttoken), 'success': success, \
+            'data': data, 'elapsed': round(time.perf_counter() - started, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate candidate Elsevier apikey/insttoken pairs concurrently")
+    parser.add_argument('file', nargs='?', default='-', help="File of credential pairs, or '-' for stdin (default)")
+    parser.add_argument('--workers', type=positiveint, default=DEFAULTWORKERS, help="Number of pairs checked at the same time")
+    parser.add_argument('--rate', type=positivefloat, default=DEFAULTRATE, help="Maximum requests per second to Elsevier")
+    args = parser.parse_args()
+
+    lines = sys.stdin if args.file == '-' else open(args.file)
+
+    limiter = ratelimiter(args.rate)
+    writer = resultwriter(PENDINGPERWORKER * args.workers)
+    with lines, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for linenumber, apikey, insttoken, error in readcredentials(lines):
+            if error is not None:
+                writer.write(parseerror(linenumber, error))
+            else:
+                writer.submit(executor, linenumber, apikey, insttoken, limiter)
+
+    sys.exit(0 if writer.allvalid else 1)
@@ -0,0 +1,85 @@
+"""
+Utility script that warms up a new sysadmin worker process before it serves its first request
+
+Compiles every template, loads each deployment's config and status and caches their rendered
+status pages, encodes the instructions PDF attached to emails and opens the connection to
+Elsevier. Called from sysadmin.wsgi when Apache starts a process, or run by hand to see timings:
+
+python3 warmup.py
+
+Each step only reads shared files or fills in-process caches, so any number of processes can
+warm up at the same time. A failing step is reported but doesn't stop the process starting
+"""
+
+import sys
+import json
+import time
+from sysadmin import app, cachedbody, renderstatus, renderfleet, fleetversion, FLEETCACHEKEY
+from scopusauthtokens.tokenchecker import statusversion, warmconnection
+from scopusauthtokens.deployments import deploymentnames, label
+from scopusauthtokens.instructions import encodedinstructions
+from scopusauthtokens.events import event
+
+
+def compiletemplates():
+    """
+    Compile every template so first request doesn't pay for parsing templates
+    """
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def cachestatus():
+    """
+    Load each deployment's config and status and cache rendered status pages and fleet dashboard
+    Deployment whose status can't be read doesn't stop other deployments being cached
+    """
+
+    unreadable = []
+    with app.test_request_context('/'):
+        for deployment in deploymentnames():
+            try:
+                version, lastmodified = statusversion(deployment)
+                cachedbody(deployment, version, lambda: renderstatus(deployment))
+            except (OSError, ValueError, KeyError):
+                unreadable.append(label(deployment))
+        version, lastmodified = fleetversion()
+        cachedbody(FLEETCACHEKEY, version, renderfleet)
+
+    if unreadable:
+        raise RuntimeError("Unable to read status of: " + ", ".join(unreadable))
+
+# Warm-up steps in order they are run
+WARMUPSTEPS = [
+    ('templates', compiletemplates),
+    ('status', cachestatus),
+    ('attachments', encodedinstructions),
+    ('connection', warmconnection),
+]
+
+
+def warmup():
+    """
+    Run every warm-up step, returning milliseconds taken by each step and any errors
+    """
+
+    started = time.perf_counter()
+    timings = {}
+    errors = {}
+    for name, step in WARMUPSTEPS:
+        stepstarted = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            errors[name] = repr(e)
+        timings[name] = round(1000 * (time.perf_counter() - stepstarted), 1)
+    total = round(1000 * (time.perf_counter() - started), 1)
+
+    event('warmup.finished', timings=timings, errors=errors, total=total)
+    return {'timings': timings, 'errors': errors, 'total': total}
+
+
+if __name__ == '__main__':
+    report = warmup()
+    print(json.dumps(report, indent=4))
+    sys.exit(1 if report['errors'] else 0)